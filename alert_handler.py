@@ -1,24 +1,67 @@
+import time
+import threading
 import logger_config
-from repository.market import MarketRepository
-from datetime import datetime, timedelta
-from calculator import Calculator
+import clock
+from datetime import timedelta
 from evaluator import Evaluator
+from dependencies import Dependencies
+from scheduler import AlertScheduler
+from thresholds import ThresholdIndex
+from backtester import Backtester
+from planner import Planner
+import metrics
 import config
 
 class AlertHandler:
-    def __init__(self, db, calculator, bot):
-        self.db = db
+    def __init__(self, store, calculator, notifier, stream=None, pool=None):
+        self.store = store
+        self.stream = stream
+        self.pool = pool
         self.log = logger_config.get_logger(__name__)
-        self.bot = bot
-        if 'chats' not in self.db:
-            self.db['chats'] = set()
-        tot_alerts = sum(len(alerts) for k,alerts in self.db.items() if k.endswith('alerts'))
-        self.log.info(f"Loaded handler db with {len(self.db['chats'])} chats registered and {tot_alerts} total alerts")
+        self.notifier = notifier
+        chats, tot_alerts = self.store.counts()
+        self.log.info(f"Loaded alert store with {chats} chats registered and {tot_alerts} total alerts")
         self.evaluator = Evaluator(calculator=calculator, visit_tokens=True)
+        self.scheduler = AlertScheduler(calculator.repository)
+        self.backtester = Backtester(calculator.repository)
+        self.planner = Planner(calculator.repository)
+        self.plans = {}
+        self.eligible = {}
+        self.touched = None
+        self.warmed = threading.Event()
+        self.lock = threading.RLock()
 
-    @staticmethod
-    def db_key(chatId):
-        return f'{chatId}-alerts'
+    def warm_up(self):
+        started = time.time()
+        with self.lock:
+            self.touched = set()
+        for chatId, name, command, ts in self.store.all():
+            key = (chatId, name)
+            try:
+                parsed = Evaluator.ALERT_PARSER.parse(command)
+                deps = Dependencies(parsed)
+                plan = self.evaluator.compile(parsed)
+            except Exception as err:
+                self.log.exception(f"Couldn't compile alert {name} of chat {chatId}: {err}")
+                continue
+            with self.lock:
+                if key in self.touched:
+                    continue
+                self.plans[key] = plan
+                self.eligible[key] = ts
+                self.scheduler.add(key, deps, ts, ThresholdIndex.match(parsed))
+                if self.pool is not None:
+                    self.pool.add(key, command, deps)
+        with self.lock:
+            self.touched = None
+        self.warmed.set()
+        self.log.info(f"Compiled {len(self.plans)} alerts into {len(self.evaluator.nodes)} shared nodes in {time.time()-started:.2f} seconds")
+        self.sync_stream()
+
+    def touch(self, key):
+        with self.lock:
+            if self.touched is not None:
+                self.touched.add(key)
 
     def create(self, chatId, command):
         command = command.strip()
@@ -29,21 +72,30 @@ class AlertHandler:
         except Exception as err:
             return f'Error while parsing the expression: {err}'
         try:
-            value = self.evaluator.eval_now(parsed)
+            self.planner.prefetch(parsed, Evaluator.now())
+            plan = self.evaluator.compile(parsed)
+            value = plan(Evaluator.now())
         except Exception as err:
             return f'Error while evaluating the expression: {err}'
-        name = AlertHandler.get_name(parsed)
-        key = AlertHandler.db_key(chatId)
-        if key not in self.db:
-            self.db[key] = {}
-            tmp = set(self.db['chats'])
-            tmp.add(chatId)
-            self.db['chats'] = tmp
-        tmp = dict(self.db[key])
-        tmp[name] = (command, parsed, datetime.now())
-        if len(tmp)>config.MAX_ALERTS_PER_USER:
+        name = str(AlertHandler.get_name(parsed))
+        count = self.store.count_chat(chatId)
+        if not self.store.exists(chatId, name):
+            count += 1
+        if count>config.MAX_ALERTS_PER_USER:
             return f"Maximum alerts per user is {config.MAX_ALERTS_PER_USER}. Please remove some alerts before adding more."
-        self.db[key] = tmp
+        ts = clock.now()
+        deps = Dependencies(parsed)
+        with self.lock:
+            self.touch((chatId, name))
+            self.store.put(chatId, name, command, ts)
+            self.eligible[(chatId, name)] = ts
+            self.plans[(chatId, name)] = plan
+            self.scheduler.remove((chatId, name))
+            self.scheduler.add((chatId, name), deps, threshold=ThresholdIndex.match(parsed))
+            if self.pool is not None:
+                self.pool.remove((chatId, name))
+                self.pool.add((chatId, name), command, deps)
+        self.sync_stream()
         msg = f'Alert {name} created! Use /remove {name} to erase it.'
         if value:
             msg += '\nWARNING: alert already triggering'
@@ -57,100 +109,153 @@ class AlertHandler:
         except Exception as err:
             return f'Error while parsing the expression: {err}'
         try:
+            self.planner.prefetch(parsed, Evaluator.now())
             value = self.evaluator.eval_now(parsed)
         except Exception as err:
             return f'Error while evaluating the expression: {err}'
         return f'Result: {value}'
 
-    def cleanup_check(self, chatId):
-        key = AlertHandler.db_key(chatId)
-        if key in self.db and len(self.db[key])==0:
-            del self.db[key]
-        if key not in self.db:
-            tmp = set(self.db['chats'])
-            tmp.discard(chatId)
-            self.db['chats'] = tmp
+    def backtest(self, chatId, command):
+        command = command.strip()
+        try:
+            parsed = Evaluator.BACKTEST_PARSER.parse(command)
+        except Exception as err:
+            return f'Error while parsing the expression: {err}'
+        try:
+            fun, minutes = self.backtester.evaluator.compile(parsed)
+            if minutes>config.MAX_BACKTEST_MINUTES:
+                return f"A backtest cannot cover more than {config.MAX_BACKTEST_MINUTES//(60*24)} days."
+            end = Evaluator.now()
+            triggers = self.backtester.run(fun, end - timedelta(minutes=minutes), end)
+        except Exception as err:
+            return f'Error while evaluating the expression: {err}'
+        if not triggers:
+            return 'The alert would not have fired in that range'
+        msg = f'The alert would have fired {len(triggers)} times:\n'
+        shown = triggers[-config.MAX_BACKTEST_TRIGGERS_SHOWN:]
+        if len(shown) < len(triggers):
+            msg += f'(showing the last {len(shown)})\n'
+        for ts in shown:
+            msg += f"- {ts:%Y-%m-%d %H:%M}\n"
+        return msg
 
     def remove(self, chatId, alert):
         alert = alert.strip()
-        key = AlertHandler.db_key(chatId)
         if not alert:
-            if key in self.db:
-                del self.db[key]
-                self.cleanup_check(chatId)
-                return 'All alerts removed'
-            else:
+            names = self.store.remove_chat(chatId)
+            if not names:
                 return 'No alerts found'
-        if alert in self.db[key]:
-            tmp = dict(self.db[key])
-            del tmp[alert]
-            self.db[key] = tmp
-            self.cleanup_check(chatId)
+            for name in names:
+                self.forget((chatId, name))
+            self.sync_stream()
+            return 'All alerts removed'
+        if self.store.remove(chatId, alert):
+            self.forget((chatId, alert))
+            self.sync_stream()
             return 'Alert removed'
         else:
             return 'Alert not found'
 
+    def forget(self, key):
+        with self.lock:
+            self.touch(key)
+            self.plans.pop(key, None)
+            self.eligible.pop(key, None)
+            self.scheduler.remove(key)
+            metrics.ALERT_TIMINGS.discard(key)
+            if self.pool is not None:
+                self.pool.remove(key)
+
 
     def list(self, chatId, _command):
-        key = AlertHandler.db_key(chatId)
-        if key in self.db:
+        alerts = self.store.chat_alerts(chatId)
+        if alerts:
             msg = 'Current alerts:\n'
-            for name,(cmd,_,_) in self.db[key].items():
+            for _,cmd in alerts:
                 msg+=f"- {cmd}\n\n"
             return msg
         else:
             return 'No alert is set'
 
+    def sync_stream(self):
+        if self.stream is not None:
+            self.stream.sync(self.scheduler.pairs())
+
     @staticmethod
     def get_name(alert):
         return alert.children[0]
 
-    def process(self):
-        for chatId in self.db['chats']:
-            key = AlertHandler.db_key(chatId)
-            toUpdate = []
-            for name,(str,parsed,ts) in self.db[key].items():
-                if ts < datetime.now() and self.evaluator.eval_now(parsed):
-                    self.bot.send_message(
-                        text=f'The alert {name} was triggered!! (defined as {str})',
-                        chat_id=chatId
-                    )
-                    self.log.debug(f"{name} triggered")
-                    toUpdate.append(name)
-            tmp = dict(self.db[key])
-            for name in toUpdate:
-                tmp[name] = (tmp[name][0], tmp[name][1], datetime.now() + timedelta(hours = 1))
-            self.db[key] = tmp
-
-
-if __name__ == "__main__":
-    calculator = Calculator(MarketRepository())
-    examples = [
-        "martin price(btc/busd) > 20",
-        "clouds price(btc/busd) > 20%",
-        "tree (price(btc/busd) > 20%)",
-        # "_no price(btc/usd) > 100 and change(price(btc/usd), 24h) > 10% ",
-        # "yes change(price(btc/usd), 24h) >10%",
-        # "x123 max(change(price(btc/usd), 24h), 24h)>10% and change(price(btc/usd), 10m)>-5%",
-        "num (price(btc/busd) > 200)",
-        "ema_test ema(eth/busd, 7, 1h) > 200",
-        "ema_test ema(eth/busd, 25, 1h) > 200",
-        # "ema_test ema(eth/busd, 200, 1h) > 200",
-        "ema_test abs(ema(eth/busd, 7, 1h) - ema(eth/busd, 25, 1h)) < 0.1",
-    ]
-    # for example in examples:
-    #     print(example)
-    #     alert = Evaluator.ALERT_PARSER.parse(example)
-    #     print(alert)
-    #     print(Evaluator(calculator=calculator, visit_tokens=True).eval_now(alert))
-    #     print()
-    examples_eval = [
-        "abs(ema(eth/busd, 7, 1h) - ema(eth/busd, 25, 1h))",
-        "abs(ema(eth/busd, 7, 1h) - ema(eth/busd, 25, 1h)) > 1",
-    ]
-    for example in examples_eval:
-        print(example)
-        alert = Evaluator.EXPRESSION_PARSER.parse(example)
-        print(alert)
-        print(Evaluator(calculator=calculator, visit_tokens=True).transform(alert)(datetime.now()))
-        print()
+    def observe(self, key, seconds):
+        deps = self.scheduler.deps.get(key)
+        metrics.observe_alert(key, deps.pairs if deps is not None else (), seconds)
+
+    def evaluate(self, key, t):
+        started = time.perf_counter()
+        plan = self.plans.get(key)
+        if plan is None:
+            return False
+        try:
+            return plan(t)
+        finally:
+            self.observe(key, time.perf_counter() - started)
+
+    def triggered(self, keys, t):
+        if self.pool is None:
+            triggered = []
+            for key in keys:
+                try:
+                    if self.evaluate(key, t):
+                        triggered.append(key)
+                except Exception as err:
+                    self.log.error(f"Couldn't evaluate alert {key}: {err}")
+            return triggered
+        triggered, missing, failed, timings = self.pool.evaluate(keys, t)
+        if missing:
+            for fsym, tsym, start, end, interval in set(missing.values()):
+                try:
+                    self.evaluator.calculator.repository.get_candles(fsym, tsym, interval, start, end)
+                except Exception as err:
+                    self.log.warning(f"Couldn't fetch {fsym}/{tsym} between {start} and {end}: {err}")
+            retried, missing, retry_failed, retry_timings = self.pool.evaluate(list(missing), t)
+            triggered += retried
+            failed.update(retry_failed)
+            timings.update(retry_timings)
+        for key, seconds in timings.items():
+            self.observe(key, seconds)
+        for key in missing:
+            try:
+                if self.evaluate(key, t):
+                    triggered.append(key)
+            except Exception as err:
+                failed[key] = str(err)
+        for key, err in failed.items():
+            self.log.error(f"Couldn't evaluate alert {key}: {err}")
+        return triggered
+
+    def process(self, now=None):
+        if now is None:
+            now = clock.now()
+        t = now - timedelta(seconds=2)
+        toUpdate = []
+        messages = []
+        keys = []
+        for key in self.scheduler.collect(t, now):
+            eligible = self.eligible.get(key)
+            if key in self.plans and eligible is not None and eligible < now:
+                keys.append(key)
+        for key in self.triggered(keys, t):
+            chatId, name = key
+            alert = self.store.get(chatId, name)
+            if alert is None:
+                continue
+            command,_ = alert
+            messages.append((chatId, f'The alert {name} was triggered!! (defined as {command})'))
+            self.log.debug(f"{name} triggered")
+            until = now + timedelta(hours = 1)
+            self.eligible[key] = until
+            self.scheduler.cooldown(key, until)
+            toUpdate.append((chatId, name, until))
+        metrics.ALERTS_TRIGGERED.inc(len(toUpdate))
+        self.notifier.notify(messages)
+        self.store.set_next_eligible(toUpdate)
+
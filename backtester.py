@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+import numpy as np
+import logger_config
+from vector_calculator import VectorCalculator
+from evaluator import Evaluator
+
+class Backtester:
+    COOLDOWN = timedelta(hours=1)
+
+    def __init__(self, repository):
+        self.log = logger_config.get_logger(__name__)
+        self.calculator = VectorCalculator(repository)
+        self.evaluator = Evaluator(calculator=self.calculator, visit_tokens=True, states_filename=None)
+
+    @staticmethod
+    def cooldown(times, values):
+        fired = []
+        until = None
+        for ts in times[values].tolist():
+            if until is None or ts > until:
+                fired.append(ts)
+                until = ts + int(Backtester.COOLDOWN.total_seconds())
+        return [datetime.fromtimestamp(ts) for ts in fired]
+
+    def run(self, fun, start, end):
+        start = Evaluator.normalize_time(start)
+        end = Evaluator.normalize_time(end)
+        times = np.arange(int(start.timestamp()), int(end.timestamp())+1, 60, dtype=np.int64)
+        values = np.broadcast_to(np.asarray(fun(times), dtype=bool), times.shape)
+        return Backtester.cooldown(times, values)
+
+    def backtest(self, parsed, end=None):
+        fun, minutes = self.evaluator.compile(parsed)
+        if end is None:
+            end = Evaluator.now()
+        return self.run(fun, end - timedelta(minutes=minutes), end)
@@ -0,0 +1,43 @@
+import random
+
+PAIRS = [
+    'btc/busd', 'eth/busd', 'bnb/busd', 'ada/busd', 'xrp/busd', 'sol/busd', 'dot/busd', 'doge/busd',
+    'ltc/busd', 'link/busd', 'matic/busd', 'avax/busd', 'atom/busd', 'uni/busd', 'trx/busd', 'etc/busd',
+    'eth/btc', 'bnb/btc', 'ada/btc', 'xrp/btc',
+]
+INTERVALS = ['15m', '1h', '4h']
+
+def price_alert(rng, pair):
+    return f"price({pair}) {rng.choice('<>')} {rng.randint(40, 300)}"
+
+def ema_alert(rng, pair):
+    fast = rng.choice([7, 9, 12])
+    slow = rng.choice([21, 25, 30])
+    interval = rng.choice(INTERVALS)
+    return f"ema(price({pair}), {fast}, {interval}) > ema(price({pair}), {slow}, {interval})"
+
+def rsi_alert(rng, pair):
+    interval = rng.choice(INTERVALS)
+    if rng.random() < 0.5:
+        return f"rsi(price({pair}), 14, {interval}) < {rng.randint(20, 40)}"
+    return f"rsi(price({pair}), 14, {interval}) > {rng.randint(60, 80)}"
+
+def nested_alert(rng, pair):
+    interval = rng.choice(INTERVALS)
+    return (
+        f"if(price({pair}) > sma(price({pair}), 20, {interval}), "
+        f"change(price({pair}), {interval}), 0 - change(price({pair}), {interval})) > {rng.randint(1, 5)}%"
+    )
+
+KINDS = [(price_alert, 0.4), (ema_alert, 0.25), (rsi_alert, 0.25), (nested_alert, 0.1)]
+
+def generate(chats, alerts_per_chat, pairs=len(PAIRS), seed=0, universe=PAIRS):
+    rng = random.Random(seed)
+    kinds, weights = zip(*KINDS)
+    alerts = []
+    for chat in range(chats):
+        for i in range(alerts_per_chat):
+            kind = rng.choices(kinds, weights)[0]
+            condition = kind(rng, rng.choice(universe[:pairs]))
+            alerts.append((100000 + chat, f"{kind.__name__.split('_')[0]}{i} {condition}"))
+    return alerts
@@ -0,0 +1,97 @@
+import json
+import math
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = 128
+
+class FakeBinance:
+    UNITS = {'m': 60, 'h': 60*60, 'd': 24*60*60}
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.weights = {}
+        self.lock = threading.Lock()
+        self.server = Server(('127.0.0.1', 0), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/api'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def candle(symbol, ts):
+        base = 50 + zlib.crc32(symbol.encode()) % 200
+        minute = ts//60
+        close = base + 0.1*base*math.sin(minute/97.0) + 0.03*base*math.sin(minute/13.0)
+        return [
+            ts*1000, str(close - 0.005*base), str(close + 0.01*base), str(close - 0.01*base), str(close),
+            str(1000 + minute % 17), ts*1000 + 59999
+        ]
+
+    @staticmethod
+    def bucket(symbol, ts, step, now):
+        minutes = [FakeBinance.candle(symbol, minute) for minute in range(ts, min(ts + step, now + 1), 60)]
+        return [
+            ts*1000, minutes[0][1], str(max(float(m[2]) for m in minutes)), str(min(float(m[3]) for m in minutes)),
+            minutes[-1][4], str(sum(float(m[5]) for m in minutes)), ts*1000 + step*1000 - 1
+        ]
+
+    def klines(self, symbol, start, end, limit, interval='1m'):
+        now = int(time.time())
+        step = int(interval[:-1])*FakeBinance.UNITS[interval[-1]]
+        ts = start//1000 - (start//1000) % step
+        data = []
+        while ts*1000 <= end and ts <= now and len(data) < limit:
+            data.append(FakeBinance.candle(symbol, ts) if step == 60 else FakeBinance.bucket(symbol, ts, step, now))
+            ts += step
+        return data
+
+    def used_weight(self):
+        minute = int(time.time())//60
+        with self.lock:
+            self.requests += 1
+            self.weights[minute] = self.weights.get(minute, 0) + 2
+            return self.weights[minute]
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                body = b'{}'
+                if url.path.endswith('/klines'):
+                    body = json.dumps(fake.klines(
+                        query['symbol'][0],
+                        int(query['startTime'][0]),
+                        int(query['endTime'][0]),
+                        int(query.get('limit', ['500'])[0]),
+                        query.get('interval', ['1m'])[0]
+                    )).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('x-mbx-used-weight-1m', str(fake.used_weight()))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,90 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark.run import ensure_secrets
+
+ensure_secrets()
+
+import numpy as np
+from benchmark.fake_binance import FakeBinance
+
+EXPRESSIONS = [
+    'price(btc/busd)',
+    'ema(price(btc/busd), 9, 1h)',
+    'rsi(price(eth/busd), 14, 1h)',
+    'sma(price(eth/busd), 20, 15m)',
+    'ema(ema(price(btc/busd), 4, 5m), 3, 15m)',
+    'ema(rsi(price(btc/busd), 5, 5m), 3, 15m)',
+    'smma(rsi(price(eth/busd), 3, 1m), 4, 5m)',
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare Calculator and VectorCalculator values against a fake Binance.')
+    parser.add_argument('--hours', type=float, default=2)
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args()
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='alert-parity-')
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'log'), exist_ok=True)
+    os.chdir(workdir)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    fake = FakeBinance()
+    fake.start()
+
+    import config
+    config.BINANCE_API_URL = fake.url
+    from repository.market import MarketRepository
+    from calculator import Calculator
+    from vector_calculator import VectorCalculator
+    from evaluator import Evaluator
+
+    repository = MarketRepository()
+    end = Evaluator.normalize_time(Evaluator.now()) - timedelta(minutes=5)
+    times = np.arange(int((end - timedelta(hours=args.hours)).timestamp()), int(end.timestamp()) + 1, 60, dtype=np.int64)
+    minutes = [datetime.fromtimestamp(int(t)) for t in times]
+
+    def compile(calculator, parsed):
+        return Evaluator(calculator(repository), visit_tokens=True, states_filename=None).compile(parsed)
+
+    results = {}
+    for expression in EXPRESSIONS:
+        parsed = Evaluator.EXPRESSION_PARSER.parse(expression)
+        scalar = compile(Calculator, parsed)
+        reference = np.array([scalar(t) for t in minutes])
+        vector = compile(VectorCalculator, parsed)
+        stepped = np.array([vector(t) for t in minutes])
+        batch = np.broadcast_to(compile(VectorCalculator, parsed)(times), times.shape)
+        results[expression] = {
+            'single': abs(compile(Calculator, parsed)(end) - compile(VectorCalculator, parsed)(end)),
+            'stepped': float(np.abs(reference - stepped).max()),
+            'batch': float(np.abs(reference - batch).max()),
+        }
+
+    repository.close()
+    fake.stop()
+    return {
+        'benchmark': 'parity',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {name: value for name, value in vars(args).items() if name != 'verbose'},
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if any(diff > args.tolerance for diffs in report['results'].values() for diff in diffs.values()):
+        sys.exit(1)
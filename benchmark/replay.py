@@ -0,0 +1,224 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark.run import ensure_secrets, summary
+
+ensure_secrets()
+
+import telegram
+import telegram.ext
+from benchmark.alerts import PAIRS, generate
+
+class ReplayBot:
+    username = 'replay_bot'
+    defaults = None
+
+    def __init__(self):
+        self.sent = {}
+        self.replied = {}
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def send_message(self, text, chat_id, **kwargs):
+        with self.lock:
+            self.messages += 1
+            self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+            self.replied[chat_id] = time.perf_counter()
+            return types.SimpleNamespace(message_id=self.messages, chat_id=chat_id, text=text)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        with self.lock:
+            self.replied[chat_id] = time.perf_counter()
+            return types.SimpleNamespace(message_id=message_id, chat_id=chat_id, text=text)
+
+class ReplayUpdater:
+    def __init__(self, bot):
+        self.bot = bot
+        self.dispatcher = telegram.ext.Dispatcher(bot, queue.Queue(), workers=1)
+        self.updates = 0
+
+    def start_polling(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def command(self, chatId, text):
+        self.updates += 1
+        word = text.split()[0]
+        message = telegram.Message(
+            self.updates, datetime.now(), telegram.Chat(chatId, telegram.Chat.PRIVATE), text=text,
+            entities=[telegram.MessageEntity(telegram.MessageEntity.BOT_COMMAND, 0, len(word))], bot=self.bot
+        )
+        self.dispatcher.process_update(telegram.Update(self.updates, message=message))
+
+def symbol(pair):
+    return pair.replace('/', '').upper()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay recorded klines through the whole bot at an accelerated clock.')
+    commands = parser.add_subparsers(dest='mode', required=True)
+    record = commands.add_parser('record', help='record minute klines from Binance into csv files')
+    record.add_argument('--klines', required=True, help='directory of <SYMBOL>.csv kline files')
+    record.add_argument('--pairs', type=int, default=len(PAIRS))
+    record.add_argument('--days', type=int, default=16)
+    replay = commands.add_parser('run', help='replay the last hours of a recording')
+    replay.add_argument('--klines', required=True, help='directory of <SYMBOL>.csv kline files')
+    replay.add_argument('--hours', type=float, default=24)
+    replay.add_argument('--speed', type=float, default=1000)
+    replay.add_argument('--chats', type=int, default=100)
+    replay.add_argument('--alerts-per-chat', type=int, default=5)
+    replay.add_argument('--commands', type=int, default=50, help='/create and /eval commands spread over the replay')
+    replay.add_argument('--workers', type=int, default=1)
+    replay.add_argument('--seed', type=int, default=0)
+    replay.add_argument('--workdir', default=None)
+    replay.add_argument('--output', default='-')
+    replay.add_argument('--verbose', action='store_true')
+    return parser.parse_args()
+
+def record(args):
+    from repository.fetcher import KlineFetcher
+    from repository.market import MarketRepository
+    os.makedirs(args.klines, exist_ok=True)
+    fetcher = KlineFetcher()
+    end = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=1)
+    for pair in PAIRS[:args.pairs]:
+        rows = []
+        cursor = end - timedelta(days=args.days)
+        while cursor <= end:
+            data = fetcher.submit(symbol(pair), cursor, end, MarketRepository.KLINES_LIMIT).result()
+            if not data:
+                break
+            rows += data
+            cursor = datetime.fromtimestamp(data[-1][0]//1000 + 60)
+        with open(os.path.join(args.klines, f"{symbol(pair)}.csv"), 'w') as fp:
+            for row in rows:
+                fp.write(','.join(str(value) for value in row[:7]) + '\n')
+        print(f"Recorded {len(rows)} klines of {symbol(pair)}")
+    fetcher.close()
+
+def commands(args, universe, start, end):
+    rng = random.Random(args.seed + 1)
+    step = (end - start) / (args.commands + 1)
+    scheduled = []
+    for i, (chatId, command) in enumerate(generate(args.commands, 1, len(universe), args.seed + 1, universe)):
+        chatId += 100000
+        text = f"/create {command}" if i % 2 == 0 else f"/eval ema(price({rng.choice(universe)}), 9, 1h)"
+        scheduled.append(((start + step*(i + 1)).timestamp(), chatId, text))
+    return scheduled
+
+def run(args):
+    klines = os.path.abspath(args.klines)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='alert-replay-')
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'log'), exist_ok=True)
+    os.chdir(workdir)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    import config
+    config.HELP_FILENAME = os.path.join(ROOT, config.HELP_FILENAME)
+    config.STREAM_KLINES = False
+    config.METRICS_PORT = None
+    config.EVAL_WORKERS = args.workers
+    config.TG_GLOBAL_RATE *= args.speed
+    config.TG_CHAT_INTERVAL /= args.speed
+    config.RETENTION_INTERVAL_SECONDS /= args.speed
+    import clock
+    import metrics
+    from repository.replay import ReplayFetcher
+    from repository.alerts import AlertStore
+    from tg_bot_service import TgBotService
+
+    recorded = set(ReplayFetcher.symbols(klines))
+    universe = [pair for pair in PAIRS if symbol(pair) in recorded]
+    if not universe:
+        raise SystemExit(f"No recorded klines of a benchmark pair found in {klines}")
+    fetcher = ReplayFetcher(klines)
+    end = datetime.fromtimestamp(int(min(fetcher.load(symbol(pair))[0][-1] for pair in universe)))
+    start = end - timedelta(hours=args.hours)
+
+    store = AlertStore(config.ALERTS_DB_FILENAME)
+    for chatId, command in generate(args.chats, args.alerts_per_chat, len(universe), args.seed, universe):
+        store.put(chatId, command.split()[0], command, start - timedelta(hours=1))
+    store.close()
+    scheduled = commands(args, universe, start, end)
+
+    clock.install(clock.ReplayClock(start, args.speed))
+    bot = ReplayBot()
+    updater = ReplayUpdater(bot)
+    service = TgBotService(updater, fetcher)
+    thread = threading.Thread(target=service.run, name='replay-service')
+    began = time.perf_counter()
+    thread.start()
+    minutes = set()
+    issued = {}
+    while clock.time() < end.timestamp() and thread.is_alive():
+        while scheduled and scheduled[0][0] <= clock.time():
+            _, chatId, text = scheduled.pop(0)
+            issued[chatId] = time.perf_counter()
+            updater.command(chatId, text)
+        minute = service.alert_handler.scheduler.minute
+        if minute is not None:
+            minutes.add(minute)
+        time.sleep(0.001)
+    service.stop()
+    thread.join()
+    wall = time.perf_counter() - began
+
+    results = {}
+    results['replayed_from'] = start.isoformat(timespec='minutes')
+    results['replayed_to'] = end.isoformat(timespec='minutes')
+    results['wall_seconds'] = wall
+    results['alerts'] = len(service.alert_handler.plans)
+    results['minutes_replayed'] = int((end - start).total_seconds()//60)
+    results['minutes_processed'] = len(minutes)
+    cycles = metrics.CYCLE_SECONDS.get()
+    if cycles is not None:
+        _, total, count = cycles
+        results['cycles'] = count
+        results['cycle_mean_seconds'] = total/count
+        results['busy_fraction'] = total/wall
+        results['sustained_speed'] = args.speed*wall/total
+    results['alerts_evaluated'] = metrics.ALERTS_EVALUATED.get() or 0
+    results['alerts_triggered'] = metrics.ALERTS_TRIGGERED.get() or 0
+    results['notifications_sent'] = sum(count for chatId, count in bot.sent.items() if chatId not in issued)
+    results['notifications_pending'] = service.notifier.depth()
+    results['commands_issued'] = len(issued)
+    results['commands_answered'] = sum(1 for chatId in issued if chatId in bot.replied)
+    results['command_seconds'] = summary([bot.replied[chatId] - at for chatId, at in issued.items() if chatId in bot.replied])
+    results['replay_requests'] = fetcher.requests
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    return {
+        'benchmark': 'replay',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {name: value for name, value in vars(args).items() if name not in ('mode', 'klines', 'output', 'verbose')},
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode == 'record':
+        record(args)
+        sys.exit()
+    output = os.path.abspath(args.output) if args.output != '-' else None
+    report = json.dumps(run(args), indent=2)
+    if output is None:
+        print(report)
+    else:
+        with open(output, 'w') as fp:
+            fp.write(report + '\n')
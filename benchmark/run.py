@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def ensure_secrets():
+    import secrets
+    if hasattr(secrets, 'TG_TOKEN'):
+        return
+    stub = types.ModuleType('secrets')
+    stub.__dict__.update(vars(secrets))
+    stub.TG_TOKEN = stub.CC_API_KEY = stub.BINANCE_API_KEY = stub.BINANCE_SECRET_KEY = ''
+    sys.modules['secrets'] = stub
+
+ensure_secrets()
+
+from benchmark.fake_binance import FakeBinance
+from benchmark.alerts import generate
+
+class FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    def send_message(self, text, chat_id, **kwargs):
+        self.sent += 1
+
+def summary(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'mean': sum(values)/len(values),
+        'p50': values[len(values)//2],
+        'p95': values[min(len(values)-1, int(len(values)*0.95))],
+        'max': values[-1],
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark alert evaluation against a fake Binance.')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--alerts-per-chat', type=int, default=5)
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--creates', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake Binance response')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default='-')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args()
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='alert-bench-')
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'log'), exist_ok=True)
+    os.chdir(workdir)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    fake = FakeBinance(args.latency)
+    fake.start()
+
+    import config
+    config.BINANCE_API_URL = fake.url
+    config.EVAL_WORKERS = args.workers
+    from repository.market import MarketRepository
+    from repository.alerts import AlertStore
+    from repository.notifications import NotificationStore
+    from calculator import Calculator
+    from vector_calculator import VectorCalculator
+    from notifier import Notifier
+    from parallel import EvaluationPool
+    from alert_handler import AlertHandler
+
+    start = datetime.now().replace(second=5, microsecond=0) - timedelta(minutes=args.cycles+1)
+    store = AlertStore(config.ALERTS_DB_FILENAME)
+    for chatId, command in generate(args.chats, args.alerts_per_chat, args.pairs, args.seed):
+        store.put(chatId, command.split()[0], command, start - timedelta(hours=1))
+    results = {}
+
+    began = time.perf_counter()
+    repository = MarketRepository()
+    if config.CALCULATOR_BACKEND == 'vector':
+        calculator = VectorCalculator(repository)
+    else:
+        calculator = Calculator(repository)
+    pool = EvaluationPool(repository) if args.workers > 1 else None
+    bot = FakeBot()
+    notifications = NotificationStore(config.ALERTS_DB_FILENAME)
+    notifier = Notifier(bot, notifications)
+    notifier.start()
+    handler = AlertHandler(store, calculator, notifier, None, pool)
+    results['startup_seconds'] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    handler.warm_up()
+    results['warm_up_seconds'] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    handler.process(start)
+    results['first_cycle_seconds'] = time.perf_counter() - began
+    results['cold_start_seconds'] = results['startup_seconds'] + results['warm_up_seconds'] + results['first_cycle_seconds']
+
+    cycles = []
+    for minute in range(1, args.cycles+1):
+        began = time.perf_counter()
+        handler.process(start + timedelta(minutes=minute))
+        cycles.append(time.perf_counter() - began)
+    results['cycle_seconds'] = summary(cycles)
+
+    creates = []
+    for chatId, command in generate(args.creates, 1, args.pairs, args.seed+1):
+        began = time.perf_counter()
+        handler.create(chatId, command)
+        creates.append(time.perf_counter() - began)
+    results['create_seconds'] = summary(creates)
+
+    results['alerts'] = len(handler.plans)
+    results['shared_nodes'] = len(handler.evaluator.nodes)
+    results['notifications_queued'] = notifier.depth() + bot.sent
+    results['binance_requests'] = fake.requests
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+    notifier.stop()
+    if pool is not None:
+        pool.close()
+        results['peak_worker_rss_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024
+    repository.close()
+    store.close()
+    notifications.close()
+    fake.stop()
+    return {
+        'benchmark': 'alert_handler',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {name: value for name, value in vars(args).items() if name not in ('output', 'verbose')},
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output != '-' else None
+    report = json.dumps(run(args), indent=2)
+    if output is None:
+        print(report)
+    else:
+        with open(output, 'w') as fp:
+            fp.write(report + '\n')
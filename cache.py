@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+class TieredCache:
+    def __init__(self, db=None, max_bytes=64*1024*1024, flush_seconds=60, flush_entries=1000, sizeof=sys.getsizeof):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self.flush_entries = flush_entries
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            self.misses += 1
+        if self.db is None:
+            return default
+        value = self.db.get(key)
+        if value is None:
+            return default
+        self.put(key, value, dirty=False)
+        return value
+
+    def peek(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key][0]
+        if self.db is None:
+            return default
+        value = self.db.get(key)
+        return default if value is None else value
+
+    def put(self, key, value, dirty=True):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries[key][1]
+            self.entries[key] = (value, size)
+            self.entries.move_to_end(key)
+            self.bytes += size
+            if dirty and self.db is not None:
+                self.dirty.add(key)
+            self.evict()
+            if len(self.dirty) >= self.flush_entries or time.time() - self.last_flush >= self.flush_seconds:
+                self.flush()
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                if key in self.dirty:
+                    self.db[key] = self.entries[key][0]
+                    self.dirty.discard(key)
+                self.bytes -= self.entries.pop(key)[1]
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.dirty.discard(key)
+            if self.db is not None and key in self.db:
+                del self.db[key]
+
+    def keys(self):
+        with self.lock:
+            keys = set(self.entries)
+        if self.db is not None:
+            keys.update(self.db.keys())
+        return keys
+
+    def evict(self):
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            key, (value, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            if key in self.dirty:
+                self.db[key] = value
+                self.dirty.discard(key)
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.time()
+            if self.db is None:
+                return 0
+            flushed = len(self.dirty)
+            for key in self.dirty:
+                self.db[key] = self.entries[key][0]
+            self.dirty.clear()
+            self.db.commit()
+            return flushed
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'dirty': len(self.dirty),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
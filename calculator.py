@@ -1,18 +1,43 @@
-from datetime import timedelta
+from datetime import datetime
 import logger_config
+from indicators import SlidingExtremum
 
 class Calculator:
     def __init__(self, repository):
         self.repository = repository
         self.log = logger_config.get_logger(__name__)
 
+    @staticmethod
+    def lag(time, interval, k):
+        if not k:
+            return time
+        step = interval*60
+        ts = int(time.timestamp()) - k*step
+        return datetime.fromtimestamp(ts - ts % step + step - 60)
+
     def price(self, fsym, tsym, candle, t):
         return self.repository.get_values(fsym, tsym, t)[candle]
 
+    def candle(self, fsym, tsym, candle, interval, t):
+        if candle == 'close' and not self.repository.closed(interval, t):
+            return self.price(fsym, tsym, candle, t)
+        return self.repository.get_candle(fsym, tsym, interval, t)[candle]
+
     def change(self, fun, interval, t):
-        old = fun(t-timedelta(minutes=interval))
+        old = fun(Calculator.lag(t, interval, 1))
         return (fun(t)-old)/old
 
+    def if_exp(self, cond, p, q, t):
+        return p(t) if cond(t) else q(t)
+
+    def rsi(self, up, down, t):
+        rs_up = up(t)
+        rs_down = abs(down(t))
+        self.log.debug(f"Computing rsi, rs_up={rs_up}, rs_down={rs_down}")
+        if rs_down < 1e-9:
+            return 100.
+        return 100. - 100. / ( 1. + rs_up/rs_down)
+
     @staticmethod
     def adj(upwards, v):
         if upwards is not None and (v>0 and not upwards) or (v<0 and upwards):
@@ -20,19 +45,44 @@ class Calculator:
         return v
 
     def sma(self, fun, window, interval, time, upwards=None):
-        sma_first = time - timedelta(minutes = window*interval)
-        sum_closes = sum(Calculator.adj(upwards, fun(sma_first + timedelta(minutes = (x+1)*interval))) for x in range(window))
+        with self.repository.preload(Calculator.lag(time, interval, window-1), time, interval):
+            sum_closes = sum(Calculator.adj(upwards, fun(Calculator.lag(time, interval, k))) for k in range(window-1, -1, -1))
         return sum_closes / window
 
-    def smma(self, fun, window, interval, time, rec, alpha, upwards=None):
-        smma_prev = time - timedelta(minutes = interval)
-        smma = rec(smma_prev)
-        if smma is None:
-            self.log.info(f"Calculating smma from scratch for window={window}, interval={interval}, time={time}, upwards={upwards}")
-            smma_prev = time - timedelta(minutes = window*interval*2)
-            smma = self.sma(fun, window, interval, smma_prev, upwards=upwards)
-        while smma_prev < time:
-            smma_prev += timedelta(minutes = interval)
-            today = Calculator.adj(upwards, fun(smma_prev))
-            smma = today * alpha + smma * (1-alpha)
+    def sma_step(self, fun, window, interval, time, prev, upwards=None):
+        oldest = Calculator.adj(upwards, fun(Calculator.lag(time, interval, window)))
+        return prev + (Calculator.adj(upwards, fun(time)) - oldest) / window
+
+    def smma(self, fun, window, interval, time, alpha, upwards=None):
+        self.log.info(f"Calculating smma from scratch for window={window}, interval={interval}, time={time}, upwards={upwards}")
+        with self.repository.preload(Calculator.lag(time, interval, 3*window-1), time, interval):
+            smma = self.sma(fun, window, interval, Calculator.lag(time, interval, 2*window), upwards=upwards)
+            for k in range(2*window-1, -1, -1):
+                smma = self.smma_step(fun, interval, Calculator.lag(time, interval, k), smma, alpha, upwards)
         return smma
+
+    def smma_step(self, fun, interval, time, prev, alpha, upwards=None):
+        today = Calculator.adj(upwards, fun(time))
+        return today * alpha + prev * (1-alpha)
+
+    def extremum(self, fun, window, interval, time, sign):
+        extremum = SlidingExtremum(sign)
+        with self.repository.preload(Calculator.lag(time, interval, window-1), time, interval):
+            for k in range(window-1, -1, -1):
+                at = Calculator.lag(time, interval, k)
+                extremum.push(int(at.timestamp()), fun(at))
+        return extremum
+
+    def extremum_step(self, fun, window, interval, time, prev, sign):
+        value = fun(time)
+        extremum = prev.copy()
+        extremum.push(int(time.timestamp()), value)
+        extremum.expire(int(Calculator.lag(time, interval, window-1).timestamp()))
+        return extremum
+
+    def extremum_value(self, fun, window, interval, time, closed, sign):
+        value = fun(time)
+        best = closed.peek(int(Calculator.lag(time, interval, window-1).timestamp()))
+        if best is None:
+            return value
+        return max(value, best) if sign > 0 else min(value, best)
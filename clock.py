@@ -0,0 +1,42 @@
+import time as systime
+from datetime import datetime
+
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return systime.time()
+
+    def sleep(self, seconds):
+        systime.sleep(seconds)
+
+class ReplayClock:
+    def __init__(self, start, speed=1.0):
+        self.start = start.timestamp()
+        self.speed = speed
+        self.origin = systime.monotonic()
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def time(self):
+        return self.start + (systime.monotonic() - self.origin)*self.speed
+
+    def sleep(self, seconds):
+        systime.sleep(seconds/self.speed)
+
+CLOCK = SystemClock()
+
+def install(clock):
+    global CLOCK
+    CLOCK = clock
+
+def now():
+    return CLOCK.now()
+
+def time():
+    return CLOCK.time()
+
+def sleep(seconds):
+    CLOCK.sleep(seconds)
@@ -1,13 +1,40 @@
+import threading
 import config
 import logger_config
+import metrics
 import telegram.ext
 
 
+class Reply:
+    def __init__(self, bot, chatId, parse_mode):
+        self.bot = bot
+        self.chatId = chatId
+        self.parse_mode = parse_mode
+        self.message = None
+        self.done = False
+        self.lock = threading.Lock()
+
+    def progress(self):
+        with self.lock:
+            if self.message is None and not self.done:
+                self.message = self.bot.send_message(text="Computing…", chat_id=self.chatId)
+
+    def send(self, text):
+        with self.lock:
+            self.done = True
+            if self.message is None:
+                self.bot.send_message(text=text, parse_mode=self.parse_mode, chat_id=self.chatId)
+            else:
+                self.bot.edit_message_text(text=text, parse_mode=self.parse_mode, chat_id=self.chatId, message_id=self.message.message_id)
+
+
 class CommandHandler:
+    SLOW = {'create', 'eval', 'backtest'}
 
-    def __init__(self, alert_handler, dispatcher):
+    def __init__(self, alert_handler, dispatcher, pool=None):
         self.log = logger_config.get_logger(__name__)
         self.alert_handler = alert_handler
+        self.pool = pool
         with open(config.HELP_FILENAME, 'r') as fp:
             self.help_file = fp.read()
         self.cmd_map = [
@@ -17,6 +44,8 @@ class CommandHandler:
             ('remove', self.alert_handler.remove, None),
             ('create', self.alert_handler.create, None),
             ('eval', self.alert_handler.eval, None),
+            ('backtest', self.alert_handler.backtest, None),
+            ('stats', self.stats, None),
         ]
         self.add_handlers(dispatcher)
 
@@ -30,7 +59,19 @@ class CommandHandler:
                     parse_mode=parse_mode,
                     chat_id=chatId
                 )
-            handler = telegram.ext.CommandHandler(word, lambda update, context, fun=fun, parse_mode=parse_mode: run_fun(fun, parse_mode, update, context)
+            def submit_fun(fun, parse_mode, update, context):
+                chatId = update.effective_chat.id
+                command = ' '.join(context.args)
+                reply = Reply(context.bot, chatId, parse_mode)
+                if self.pool.submit(chatId, lambda: fun(chatId, command), reply):
+                    return
+                if self.pool.running(chatId):
+                    text = "I'm still computing your previous command, please wait for it to finish."
+                else:
+                    text = "Too many commands are being computed right now, please try again in a minute."
+                context.bot.send_message(text=text, chat_id=chatId)
+            run = submit_fun if self.pool is not None and word in CommandHandler.SLOW else run_fun
+            handler = telegram.ext.CommandHandler(word, lambda update, context, run=run, fun=fun, parse_mode=parse_mode: run(fun, parse_mode, update, context)
             )
             dispatcher.add_handler(handler)
         unknown_handler = telegram.ext.MessageHandler(telegram.ext.Filters.command, self.unknown)
@@ -41,3 +82,8 @@ class CommandHandler:
 
     def help(self, chatId, _command):
         return self.help_file
+
+    def stats(self, chatId, _command):
+        if chatId not in config.ADMIN_CHAT_IDS:
+            return "Sorry, I didn't understand that command."
+        return metrics.summary()
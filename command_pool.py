@@ -0,0 +1,55 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logger_config
+import config
+import deadline
+
+class CommandPool:
+    def __init__(self, workers=config.COMMAND_WORKERS, limit=config.COMMAND_QUEUE_LIMIT, timeout=config.COMMAND_TIMEOUT_SECONDS):
+        self.log = logger_config.get_logger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='command')
+        self.limit = limit
+        self.timeout = timeout
+        self.busy = set()
+        self.lock = threading.Lock()
+
+    def depth(self):
+        with self.lock:
+            return len(self.busy)
+
+    def running(self, chatId):
+        with self.lock:
+            return chatId in self.busy
+
+    def submit(self, chatId, fun, reply):
+        with self.lock:
+            if chatId in self.busy or len(self.busy) >= self.limit:
+                return False
+            self.busy.add(chatId)
+        self.executor.submit(self.run, chatId, fun, reply)
+        return True
+
+    def run(self, chatId, fun, reply):
+        started = time.time()
+        timer = threading.Timer(config.COMMAND_PROGRESS_SECONDS, reply.progress)
+        timer.daemon = True
+        timer.start()
+        try:
+            with deadline.limit(self.timeout):
+                text = fun()
+        except Exception as err:
+            self.log.exception(f"Command of chat {chatId} failed: {err}")
+            text = "Sorry, something went wrong while running that command."
+        finally:
+            timer.cancel()
+            with self.lock:
+                self.busy.discard(chatId)
+        self.log.debug(f"Command of chat {chatId} took {time.time()-started:.2f} seconds")
+        try:
+            reply.send(text)
+        except Exception as err:
+            self.log.exception(f"Couldn't reply to chat {chatId}: {err}")
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
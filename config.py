@@ -4,8 +4,40 @@ from pathlib import Path
 TG_TOKEN = secrets.TG_TOKEN
 CC_API_KEY = secrets.CC_API_KEY
 DB_FILENAME = str(Path("data") / "db.3.sqlite")
+ALERTS_DB_FILENAME = str(Path("data") / "alerts.sqlite")
 PRICES_DB_FILENAME = str(Path("data") / "prices.sqlite")
-HANDLER_CACHE_DB_FILENAME  = str(Path("data") / "handler_cache.3.sqlite")
+CANDLES_DB_FILENAME = str(Path("data") / "candles.sqlite")
+ARCHIVE_DIRNAME = str(Path("data") / "archive")
+HANDLER_CACHE_DB_FILENAME  = str(Path("data") / "handler_cache.5.sqlite")
 HELP_FILENAME = 'readme.md'
 MAX_ALERT_LENGTH = 1000
 MAX_ALERTS_PER_USER = 20
+BINANCE_API_URL = None
+BINANCE_WEIGHT_LIMIT = 1200
+STREAM_KLINES = True
+STREAM_GRACE_SECONDS = 10
+CALCULATOR_BACKEND = 'vector'
+HANDLER_CACHE_MAX_BYTES = 256*1024*1024
+HANDLER_CACHE_FLUSH_SECONDS = 60
+HANDLER_CACHE_FLUSH_ENTRIES = 5000
+PRICES_CACHE_MAX_BYTES = 64*1024*1024
+TG_GLOBAL_RATE = 30
+TG_CHAT_INTERVAL = 1
+EVAL_WORKERS = 1
+MAX_BACKTEST_MINUTES = 31*24*60
+MAX_BACKTEST_TRIGGERS_SHOWN = 20
+METRICS_PORT = 9108
+ADMIN_CHAT_IDS = set()
+CANDLES_CACHE_KIB = 64*1024
+RETENTION_INTERVAL_SECONDS = 60*60
+CANDLE_RETENTION_DAYS = 45
+COARSE_CANDLE_SECONDS = 60*60
+VACUUM_PAGES_PER_STEP = 256
+COMMAND_WORKERS = 4
+COMMAND_QUEUE_LIMIT = 32
+COMMAND_TIMEOUT_SECONDS = 30
+COMMAND_PROGRESS_SECONDS = 1
+MAX_PLAN_REQUESTS = 20
+ARCHIVE_AFTER_DAYS = 2
+ARCHIVE_DTYPE = 'float64'
+ARCHIVE_OPEN_FILES = 256
@@ -0,0 +1,27 @@
+import threading
+import time
+from contextlib import contextmanager
+from exceptions import DeadlineExceededException
+
+LOCAL = threading.local()
+
+@contextmanager
+def limit(seconds):
+    outer = getattr(LOCAL, 'deadline', None)
+    deadline = (time.monotonic() + seconds, seconds)
+    LOCAL.deadline = deadline if outer is None or deadline[0] < outer[0] else outer
+    try:
+        yield
+    finally:
+        LOCAL.deadline = outer
+
+def remaining():
+    deadline = getattr(LOCAL, 'deadline', None)
+    if deadline is None:
+        return None
+    return max(0.0, deadline[0] - time.monotonic())
+
+def check():
+    deadline = getattr(LOCAL, 'deadline', None)
+    if deadline is not None and time.monotonic() > deadline[0]:
+        raise DeadlineExceededException(deadline[1])
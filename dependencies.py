@@ -0,0 +1,43 @@
+from lark import Tree
+
+class Dependencies:
+    INTERVALS = {'minutes': 1, 'hours': 60, 'days': 60*24}
+
+    def __init__(self, parsed):
+        self.pairs = set()
+        self.intervals = set()
+        self.lookback = self.visit(parsed)
+
+    @staticmethod
+    def interval(tree):
+        for child in tree.children:
+            if isinstance(child, Tree) and child.data in Dependencies.INTERVALS:
+                return int(child.children[0])*Dependencies.INTERVALS[child.data]
+        return None
+
+    @staticmethod
+    def window(tree):
+        return next(int(child) for child in tree.children if not isinstance(child, Tree))
+
+    def visit(self, tree):
+        if tree.data == 'pair':
+            self.pairs.add((str(tree.children[0]).upper(), str(tree.children[1]).upper()))
+            return 0
+        lookback = max((self.visit(child) for child in tree.children if isinstance(child, Tree)), default=0)
+        interval = Dependencies.interval(tree)
+        if interval is None:
+            return lookback
+        self.intervals.add(interval)
+        return lookback + Dependencies.lags(tree)*interval
+
+    @staticmethod
+    def lags(tree):
+        if tree.data == 'change':
+            return 1
+        if tree.data in ('sma', 'max', 'min'):
+            return Dependencies.window(tree)
+        if tree.data in ('ema', 'smma'):
+            return 3*Dependencies.window(tree)
+        if tree.data == 'rsi':
+            return 3*Dependencies.window(tree)+1
+        return 0
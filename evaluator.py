@@ -2,8 +2,43 @@ from lark import Lark, Transformer
 import logger_config
 from sqlitedict import SqliteDict
 from exceptions import InvalidIndicatorSource
-from config import HANDLER_CACHE_DB_FILENAME
+from indicators import IndicatorState
+from cache import TieredCache
+from repository.sqlite import enable_incremental_vacuum_file, LazyDict
+from repository.market import MarketRepository
+import config
+import clock
+import deadline
 from datetime import datetime, timedelta
+import weakref
+import threading
+import numpy as np
+
+class Node:
+    def __init__(self, fun, revision=None):
+        self.fun = fun
+        self.revision = revision
+        self.last = (None, None)
+
+    def __call__(self, t):
+        deadline.check()
+        if not isinstance(t, datetime):
+            return self.fun(t)
+        time = Evaluator.normalize_time(t)
+        key = (time, self.revision(time) if self.revision is not None else None)
+        last_key, value = self.last
+        if last_key != key:
+            value = self.fun(time)
+            self.last = (key, value)
+        return value
+
+class Parser:
+    def __init__(self, lark, start):
+        self.lark = lark
+        self.start = start
+
+    def parse(self, text):
+        return self.lark.parse(text, start=self.start)
 
 class Evaluator(Transformer):
     DSL = r"""
@@ -46,8 +81,8 @@ class Evaluator(Transformer):
         | value MATH_OPERATOR value -> math_op
         | "abs" "(" value ")" -> absolut
         | "rsi" "(" value "," INT "," time_interval ")"         -> rsi
-        // | "max" "(" value "," INT "," time_interval ")"         -> max
-        // | "min" "(" value "," INT "," time_interval ")"         -> min
+        | "max" "(" value "," INT "," time_interval ")"         -> max
+        | "min" "(" value "," INT "," time_interval ")"         -> min
         ?condition: "(" condition ")"
         | condition LOGICAL_OPERATOR condition
         | value COMPARATOR value
@@ -57,6 +92,8 @@ class Evaluator(Transformer):
 
         alert: CNAME condition
 
+        backtest: condition time_interval
+
         %import common.DIGIT
         %import common.INT
         %import common.CNAME
@@ -65,18 +102,42 @@ class Evaluator(Transformer):
         %import common.WS
         %ignore WS
     """
-    ALERT_PARSER = Lark(DSL, start='alert', parser='lalr')
-    EXPRESSION_PARSER = Lark(DSL, start='expression', parser='lalr')
+    PARSER = Lark(DSL, start=['alert', 'expression', 'backtest'], parser='lalr', cache=True)
+    ALERT_PARSER = Parser(PARSER, 'alert')
+    EXPRESSION_PARSER = Parser(PARSER, 'expression')
+    BACKTEST_PARSER = Parser(PARSER, 'backtest')
 
-    def __init__(self, calculator, *args, **kwargs):
+    def __init__(self, calculator, *args, states_filename=config.HANDLER_CACHE_DB_FILENAME, **kwargs):
         super(Evaluator, self).__init__(*args, **kwargs)
         self.log = logger_config.get_logger(__name__)
         self.calculator = calculator
-        self.db = SqliteDict(HANDLER_CACHE_DB_FILENAME, autocommit=True)
-        self.log.info(f"Loaded handler cache db with {len(self.db)} entries")
+        self.nodes = weakref.WeakValueDictionary()
+        self.nodes_lock = threading.RLock()
+        self.db = None
+        if states_filename is not None:
+            self.db = LazyDict(lambda: Evaluator.open_states(states_filename))
+        self.states = TieredCache(
+            self.db,
+            max_bytes=config.HANDLER_CACHE_MAX_BYTES,
+            flush_seconds=config.HANDLER_CACHE_FLUSH_SECONDS,
+            flush_entries=config.HANDLER_CACHE_FLUSH_ENTRIES,
+            sizeof=IndicatorState.sizeof
+        )
+
+    @staticmethod
+    def open_states(filename):
+        enable_incremental_vacuum_file(filename)
+        return SqliteDict(filename)
+
+    def compile(self, parsed):
+        return self.transform(parsed)
+
+    @staticmethod
+    def now():
+        return clock.now() - timedelta(seconds=2)
 
     def eval_now(self, parsed):
-        return self.transform(parsed)(datetime.now() - timedelta(seconds=2))
+        return self.compile(parsed)(Evaluator.now())
 
     INT = int
     CNAME = str
@@ -88,7 +149,7 @@ class Evaluator(Transformer):
 
     def number(self, x):
         n = float(x[0])
-        return (f"{n:.2E}", lambda t: n)
+        return (repr(n), lambda t: n)
 
     def minutes(self, x):
         return int(x[0])
@@ -101,7 +162,7 @@ class Evaluator(Transformer):
 
     def percentage(self, x):
         n = float(x[0])/100
-        return (f"{n:.2E}", lambda t: n)
+        return (repr(n), lambda t: n)
 
     def MATH_OPERATOR(self, c):
         if c=='+':
@@ -127,9 +188,9 @@ class Evaluator(Transformer):
 
     def LOGICAL_OPERATOR(self, c):
         if c=='and':
-            return (c, lambda a,b: a and b)
+            return (c, lambda a,b: a & b)
         elif c=='or':
-            return (c, lambda a,b: a or b)
+            return (c, lambda a,b: a | b)
         raise Exception(f"Unknown logical operator {c}")
 
     def pair(self, args):
@@ -139,102 +200,186 @@ class Evaluator(Transformer):
     def normalize_time(time):
         return time.replace(second = 0, microsecond =0)
 
-    def memoize(self, desc, fun):
-        def rec_fun(time):
-            time = Evaluator.normalize_time(time)
-            key = f"{desc}@{time.timestamp()}"
-            if key not in self.db:
-                return None
-            return self.db[key]
+    def revision(self, time):
+        if time.timestamp() < MarketRepository.closed_minute():
+            return None
+        return self.calculator.repository.revision
 
-        def mem_fun(time):
+    def shared(self, desc, fun, frame=None):
+        with self.nodes_lock:
+            node = self.nodes.get(desc)
+            if node is None:
+                node = Node(fun, self.revision)
+                node.frame = frame
+                self.nodes[desc] = node
+        return (desc, node)
+
+    def framed(self, child, interval):
+        frame = getattr(child[1], 'frame', None)
+        return child if frame is None or interval == 1 else frame(interval)
+
+    def state(self, desc, interval, window):
+        state = self.states.get(desc)
+        if state is None or (state.interval, state.window) != (interval, window):
+            state = IndicatorState(interval, window)
+        return state
+
+    def incremental(self, desc, interval, window, seed, step, current=None):
+        def fun(time):
+            if not isinstance(time, datetime):
+                values = seed(time)
+                if current is None:
+                    self.settle(desc, interval, window, time, values)
+                return values
             time = Evaluator.normalize_time(time)
-            key = f"{desc}@{time.timestamp()}"
-            if key not in self.db:
-                self.db[key] = fun(time, rec_fun)
-            return self.db[key]
-        return (desc, mem_fun)
+            state = self.state(desc, interval, window)
+            value = state.value(time, seed, step, current)
+            self.states.put(desc, state)
+            return value
+        return self.shared(desc, fun)
+
+    def settle(self, desc, interval, window, times, values):
+        step = interval*60
+        closed = np.flatnonzero(times % step == step - 60)
+        if not len(closed):
+            return
+        last = closed[np.argmax(times[closed])]
+        state = self.state(desc, interval, window)
+        if state.settle(datetime.fromtimestamp(int(times[last])), float(np.broadcast_to(values, times.shape)[last])):
+            self.states.put(desc, state)
+
+    def checkpoint(self):
+        flushed = self.states.flush()
+        self.log.debug(f"Checkpointed {flushed} indicator states")
 
     def price(self, args):
         candle, (fsym, tsym) = args
         if candle == 'price':
             candle = 'close'
-        return (
+        return self.shared(
             f"{candle}:{fsym}/{tsym}",
-            lambda t: self.calculator.price(fsym, tsym, candle, Evaluator.normalize_time(t))
+            lambda t: self.calculator.price(fsym, tsym, candle, t),
+            lambda interval: self.candle(fsym, tsym, candle, interval)
+        )
+
+    def candle(self, fsym, tsym, candle, interval):
+        return self.shared(
+            f"{candle}:{fsym}/{tsym}:{interval}",
+            lambda t: self.calculator.candle(fsym, tsym, candle, interval, t)
         )
 
     def change(self, args):
-        (desc, fun), interval = args
-        return (
+        child, interval = args
+        (desc, fun) = self.framed(child, interval)
+        return self.shared(
             f"change:({desc}):{interval}",
             lambda t: self.calculator.change(fun, interval, t)
         )
 
     def ema(self, args):
-        (desc, fun), window, interval = args
+        child, window, interval = args
+        (desc, fun) = self.framed(child, interval)
         if not desc:
             raise InvalidIndicatorSource("ema")
-        return self.memoize(
+        alpha = 2.0/(window+1)
+        return self.incremental(
             f"ema:({desc}):{window}:{interval}",
-            lambda t,rec: self.calculator.smma(fun, window, interval, t, rec, alpha=2.0/(window+1), upwards=None)
+            interval,
+            window,
+            lambda t: self.calculator.smma(fun, window, interval, t, alpha=alpha, upwards=None),
+            lambda t,prev: self.calculator.smma_step(fun, interval, t, prev, alpha=alpha, upwards=None)
         )
 
     def sma(self, args):
-        (desc, fun), window, interval = args
+        child, window, interval = args
+        (desc, fun) = self.framed(child, interval)
         if not desc:
             raise InvalidIndicatorSource("sma")
-        return self.memoize(
+        return self.incremental(
             f"sma:({desc}):{window}:{interval}",
-            lambda t,_: self.calculator.sma(fun, window, interval, t)
+            interval,
+            window,
+            lambda t: self.calculator.sma(fun, window, interval, t),
+            lambda t,prev: self.calculator.sma_step(fun, window, interval, t, prev)
         )
 
     def smma(self, args, upwards=None):
-        (desc, fun), window, interval = args
+        child, window, interval = args
+        (desc, fun) = self.framed(child, interval)
         if not desc:
             raise InvalidIndicatorSource("smma")
-        return self.memoize(
+        return self.incremental(
             f"smma:({desc}):{window}:{interval}:{upwards}",
-            lambda t,rec: self.calculator.smma(fun, window, interval, t, rec, upwards=upwards, alpha=1.0/window)
+            interval,
+            window,
+            lambda t: self.calculator.smma(fun, window, interval, t, upwards=upwards, alpha=1.0/window),
+            lambda t,prev: self.calculator.smma_step(fun, interval, t, prev, upwards=upwards, alpha=1.0/window)
         )
 
     def rsi(self, args):
         child, window, interval = args
+        child = self.framed(child, interval)
         (desc, fun) = child
         if not desc:
             raise InvalidIndicatorSource("rsi")
-        def calc(t):
-            change = self.change([child, interval])
-            _, rs_up = self.smma([change, window, interval], True)
-            rs_up = rs_up(t)
-            _, rs_down = self.smma([change, window, interval], False)
-            rs_down = abs(rs_down(t))
-            self.log.debug(f"Computing rsi:({desc}):{window}:{interval}, rs_up={rs_up}, rs_down={rs_down}")
-            if rs_down < 1e-9:
-                return 100.
-            return 100. - 100. / ( 1. + rs_up/rs_down)
-        return (
+        change = self.change([child, interval])
+        _, rs_up_fun = self.smma([change, window, interval], True)
+        _, rs_down_fun = self.smma([change, window, interval], False)
+        return self.shared(
             f"rsi:({desc}):{window}:{interval}",
-            calc
+            lambda t: self.calculator.rsi(rs_up_fun, rs_down_fun, t)
+        )
+
+    def max(self, args):
+        return self.extremum(args, 'max', 1)
+
+    def min(self, args):
+        return self.extremum(args, 'min', -1)
+
+    def extremum(self, args, name, sign):
+        child, window, interval = args
+        (desc, fun) = self.framed(child, interval)
+        if not desc:
+            raise InvalidIndicatorSource(name)
+        return self.incremental(
+            f"{name}:({desc}):{window}:{interval}",
+            interval,
+            window,
+            lambda t: self.calculator.extremum(fun, window, interval, t, sign),
+            lambda t,prev: self.calculator.extremum_step(fun, window, interval, t, prev, sign),
+            lambda t,closed: self.calculator.extremum_value(fun, window, interval, t, closed, sign)
         )
 
     def condition(self, args):
         (p_desc, p), (c_desc, c), (q_desc, q) = args
-        return (f"({p_desc}){c_desc}({q_desc})", lambda t: c(p(t), q(t)))
+        return self.shared(
+            f"({p_desc}){c_desc}({q_desc})",
+            lambda t: c(p(t), q(t)),
+            lambda interval: self.condition([self.framed(args[0], interval), args[1], self.framed(args[2], interval)])
+        )
 
     def math_op(self, args):
         (p_desc, p), (c_desc, c), (q_desc, q) = args
-        return (f"({p_desc}){c_desc}({q_desc})", lambda t: c(p(t), q(t)))
+        return self.shared(
+            f"({p_desc}){c_desc}({q_desc})",
+            lambda t: c(p(t), q(t)),
+            lambda interval: self.math_op([self.framed(args[0], interval), args[1], self.framed(args[2], interval)])
+        )
 
     def absolut(self, args):
         (desc, fun) = args[0]
-        return (f"abs({desc})", lambda t: abs(fun(t)))
+        return self.shared(
+            f"abs({desc})",
+            lambda t: abs(fun(t)),
+            lambda interval: self.absolut([self.framed(args[0], interval)])
+        )
 
     def if_exp(self, args):
         (c_desc, c), (p_desc, p), (q_desc, q) = args
-        return (
+        return self.shared(
             f"if({c_desc})({p_desc})({q_desc})",
-            lambda t: p(t) if c(t) else q(t)
+            lambda t: self.calculator.if_exp(c, p, q, t),
+            lambda interval: self.if_exp([self.framed(child, interval) for child in args])
         )
 
     def expression(self, args):
@@ -243,3 +388,7 @@ class Evaluator(Transformer):
     def alert(self, args):
         name, cond = args
         return lambda t: cond[1](t)
+
+    def backtest(self, args):
+        cond, minutes = args
+        return cond[1], minutes
@@ -9,3 +9,21 @@ class InvalidIndicatorSource(Exception):
     def __init__(self, indicator):
         self.message = f"The indicator {indicator} was provided an invalid source, use price for example."
         super().__init__(self.message)
+
+class MissingCandlesException(Exception):
+    def __init__(self, fsym, tsym, start, end, interval=1):
+        self.fsym, self.tsym, self.start, self.end, self.interval = fsym, tsym, start, end, interval
+        self.message = f"Candles for {fsym}/{tsym} between {start} and {end} are not stored yet"
+        super().__init__(self.message)
+
+class DeadlineExceededException(Exception):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.message = f"The computation took more than {seconds} seconds and was cancelled, try a smaller window or interval"
+        super().__init__(self.message)
+
+class PlanTooExpensiveException(Exception):
+    def __init__(self, cost, budget):
+        self.cost, self.budget = cost, budget
+        self.message = f"This expression needs about {cost} Binance requests to evaluate but at most {budget} are allowed, try a smaller window or a larger interval"
+        super().__init__(self.message)
@@ -0,0 +1,81 @@
+import threading
+import collections
+from datetime import datetime
+
+class SlidingExtremum:
+    def __init__(self, sign, entries=()):
+        self.sign = sign
+        self.entries = collections.deque(entries)
+
+    def copy(self):
+        return SlidingExtremum(self.sign, self.entries)
+
+    def push(self, ts, value):
+        while self.entries and self.sign*self.entries[-1][1] <= self.sign*value:
+            self.entries.pop()
+        self.entries.append((ts, value))
+
+    def expire(self, ts):
+        while self.entries and self.entries[0][0] < ts:
+            self.entries.popleft()
+
+    def peek(self, ts):
+        for entry_ts, value in self.entries:
+            if entry_ts >= ts:
+                return value
+        return None
+
+    def sizeof(self):
+        return 64 + 32*len(self.entries)
+
+class IndicatorState:
+    def __init__(self, interval, window):
+        self.interval = interval
+        self.window = window
+        self.last = None
+        self.closed = None
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        with self.lock:
+            return (self.interval, self.window, self.last, self.closed)
+
+    def __setstate__(self, state):
+        self.interval, self.window, self.last, self.closed = state
+        self.lock = threading.RLock()
+
+    def sizeof(self):
+        return 128 + (self.closed.sizeof() if isinstance(self.closed, SlidingExtremum) else 16)
+
+    def end(self, time):
+        step = self.interval*60
+        ts = int(time.timestamp()) + 60
+        return datetime.fromtimestamp(ts - ts % step - 60)
+
+    def settle(self, end, closed):
+        with self.lock:
+            if self.last is not None:
+                return False
+            self.last = end
+            self.closed = closed
+            return True
+
+    def value(self, time, seed, step, current=None):
+        with self.lock:
+            end = self.end(time)
+            if self.last is not None and end < self.last:
+                closed = seed(end)
+            else:
+                if self.last is None or (end - self.last).total_seconds() > self.interval*60*self.window:
+                    closed = seed(end)
+                else:
+                    closed = self.closed
+                    last = int(self.last.timestamp())
+                    while last < int(end.timestamp()):
+                        last += self.interval*60
+                        closed = step(datetime.fromtimestamp(last), closed)
+                self.last = end
+                self.closed = closed
+            if current is not None:
+                return current(time, closed)
+            return closed if end == time else step(time, closed)
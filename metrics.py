@@ -0,0 +1,221 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import logger_config
+
+class Metric:
+    TYPE = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels))
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    @staticmethod
+    def format_labels(names, values):
+        if not names:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+        return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+    def samples(self):
+        with self.lock:
+            return [('', self.labels, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{Metric.format_labels(names, values)} {value}')
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0]*len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        names = self.labels + ('le',)
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket in zip(self.buckets, counts):
+                    samples.append(('_bucket', names, key + (repr(float(bound)),), bucket))
+                samples.append(('_bucket', names, key + ('+Inf',), count))
+                samples.append(('_sum', self.labels, key, total))
+                samples.append(('_count', self.labels, key, count))
+        return samples
+
+class Timings:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self.lock:
+            count, total, _ = self.values.get(key, (0, 0.0, 0.0))
+            self.values[key] = (count + 1, total + seconds, seconds)
+
+    def discard(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def top(self, n):
+        with self.lock:
+            items = list(self.values.items())
+        return sorted(items, key=lambda item: item[1][1]/item[1][0], reverse=True)[:n]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        for collector in self.collectors:
+            collector()
+
+    def render(self):
+        self.collect()
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+REGISTRY = Registry()
+CYCLE_SECONDS = REGISTRY.register(Histogram('alert_cycle_seconds', 'Duration of an alert processing cycle.'))
+ALERTS_EVALUATED = REGISTRY.register(Counter('alerts_evaluated_total', 'Alert evaluations.'))
+ALERTS_TRIGGERED = REGISTRY.register(Counter('alerts_triggered_total', 'Alerts that fired.'))
+ALERT_SECONDS = REGISTRY.register(Histogram('alert_evaluation_seconds', 'Time spent evaluating a single alert.'))
+PAIR_SECONDS = REGISTRY.register(Counter('pair_evaluation_seconds_total', 'Alert evaluation time attributed to each pair.', ('pair',)))
+SLOWEST_ALERTS = REGISTRY.register(Gauge('alert_slowest_evaluation_seconds', 'Mean evaluation time of the slowest alerts.', ('chat', 'alert')))
+BINANCE_REQUESTS = REGISTRY.register(Counter('binance_requests_total', 'Kline requests sent to Binance.', ('status',)))
+BINANCE_SECONDS = REGISTRY.register(Histogram('binance_request_seconds', 'Latency of Binance kline requests.'))
+BINANCE_SYMBOL_REQUESTS = REGISTRY.register(Counter('binance_symbol_requests_total', 'Kline requests sent to Binance per symbol.', ('symbol',)))
+CACHE_HITS = REGISTRY.register(Counter('cache_hits_total', 'Cache hits.', ('cache',)))
+CACHE_MISSES = REGISTRY.register(Counter('cache_misses_total', 'Cache misses.', ('cache',)))
+CACHE_EVICTIONS = REGISTRY.register(Counter('cache_evictions_total', 'Cache evictions.', ('cache',)))
+CACHE_ENTRIES = REGISTRY.register(Gauge('cache_entries', 'Entries held in memory by a cache.', ('cache',)))
+CACHE_BYTES = REGISTRY.register(Gauge('cache_bytes', 'Estimated bytes held in memory by a cache.', ('cache',)))
+DB_BYTES = REGISTRY.register(Gauge('db_size_bytes', 'Size of a database on disk, including its WAL.', ('db',)))
+QUEUE_DEPTH = REGISTRY.register(Gauge('queue_depth', 'Items waiting in an internal queue.', ('queue',)))
+ALERT_TIMINGS = Timings()
+
+def observe_alert(key, pairs, seconds):
+    ALERTS_EVALUATED.inc()
+    ALERT_SECONDS.observe(seconds)
+    ALERT_TIMINGS.observe(key, seconds)
+    for fsym, tsym in pairs:
+        PAIR_SECONDS.inc(seconds, pair=f'{fsym}/{tsym}')
+
+def collect_slowest(n=10):
+    SLOWEST_ALERTS.clear()
+    for (chatId, name), (count, total, _) in ALERT_TIMINGS.top(n):
+        SLOWEST_ALERTS.set(total/count, chat=chatId, alert=name)
+
+REGISTRY.collectors.append(collect_slowest)
+
+def summary(n=5):
+    REGISTRY.collect()
+    lines = []
+    cycles = CYCLE_SECONDS.get()
+    if cycles is not None:
+        _, total, count = cycles
+        lines.append(f"Cycles: {count}, mean {total/count:.3f}s")
+    lines.append(f"Alerts evaluated: {ALERTS_EVALUATED.get() or 0}, triggered: {ALERTS_TRIGGERED.get() or 0}")
+    lines.append('Slowest alerts:')
+    for (chatId, name), (count, total, last) in ALERT_TIMINGS.top(n):
+        lines.append(f"- {chatId}/{name}: mean {total/count*1000:.1f}ms, last {last*1000:.1f}ms")
+    lines.append('Slowest pairs:')
+    pairs = sorted(((value, key[0]) for _, _, key, value in PAIR_SECONDS.samples()), reverse=True)[:n]
+    for seconds, pair in pairs:
+        lines.append(f"- {pair}: {seconds:.2f}s")
+    requests = {key[0]: value for _, _, key, value in BINANCE_REQUESTS.samples()}
+    latency = BINANCE_SECONDS.get()
+    mean = f", mean {latency[1]/latency[2]*1000:.0f}ms" if latency else ''
+    lines.append(f"Binance requests: {requests}{mean}")
+    for _, _, (cache,), hits in CACHE_HITS.samples():
+        misses = CACHE_MISSES.get(cache=cache) or 0
+        rate = hits/(hits+misses) if hits+misses else 0
+        lines.append(f"Cache {cache}: {CACHE_ENTRIES.get(cache=cache)} entries, hit rate {rate:.1%}")
+    for _, _, (db,), size in DB_BYTES.samples():
+        lines.append(f"DB {db}: {size/1024/1024:.1f} MB")
+    lines.append('Queues: ' + ', '.join(f"{queue}={depth}" for _, _, (queue,), depth in QUEUE_DEPTH.samples()))
+    return '\n'.join(lines)
+
+class MetricsServer:
+    def __init__(self, port, host='127.0.0.1', registry=REGISTRY):
+        self.log = logger_config.get_logger(__name__)
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.log.info(f"Serving metrics on port {self.server.server_port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
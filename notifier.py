@@ -0,0 +1,125 @@
+import time
+import threading
+from collections import deque
+from telegram.constants import MAX_MESSAGE_LENGTH
+from telegram.error import RetryAfter, Unauthorized, BadRequest, ChatMigrated
+import logger_config
+import config
+
+class Notifier:
+    MAX_ATTEMPTS = 10
+    MAX_BACKOFF = 300
+
+    def __init__(self, bot, store, global_rate=config.TG_GLOBAL_RATE, chat_interval=config.TG_CHAT_INTERVAL):
+        self.log = logger_config.get_logger(__name__)
+        self.bot = bot
+        self.store = store
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.queues = {}
+        self.ready_at = {}
+        self.sent = deque()
+        self.paused_until = 0
+        self.stopping = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        for id, chatId, text, attempts in self.store.pending():
+            self.queues.setdefault(chatId, deque()).append((id, text, attempts))
+        if self.queues:
+            self.log.info(f"Restored {self.depth()} undelivered notifications for {len(self.queues)} chats")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join()
+
+    def notify(self, messages):
+        if not messages:
+            return
+        ids = self.store.add(messages)
+        with self.cond:
+            for id, (chatId, text) in zip(ids, messages):
+                self.queues.setdefault(chatId, deque()).append((id, text, 0))
+            self.cond.notify()
+
+    def depth(self):
+        with self.cond:
+            return sum(len(queue) for queue in self.queues.values())
+
+    @staticmethod
+    def coalesce(queue):
+        batch = [queue[0]]
+        length = len(queue[0][1])
+        for item in list(queue)[1:]:
+            length += len(item[1]) + 2
+            if length > MAX_MESSAGE_LENGTH:
+                break
+            batch.append(item)
+        return batch
+
+    def next_batch(self, now):
+        if now < self.paused_until:
+            return None, self.paused_until - now
+        while self.sent and self.sent[0] <= now - 1:
+            self.sent.popleft()
+        if len(self.sent) >= self.global_rate:
+            return None, self.sent[0] + 1 - now
+        wait = None
+        for chatId, queue in self.queues.items():
+            ready = self.ready_at.get(chatId, 0)
+            if ready <= now:
+                return chatId, Notifier.coalesce(queue)
+            wait = ready - now if wait is None else min(wait, ready - now)
+        return None, wait
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopping:
+                        return
+                    now = time.monotonic()
+                    chatId, batch = self.next_batch(now)
+                    if chatId is not None:
+                        break
+                    self.cond.wait(batch)
+                self.ready_at[chatId] = now + self.chat_interval
+                self.sent.append(now)
+            self.deliver(chatId, batch)
+
+    def deliver(self, chatId, batch):
+        try:
+            self.bot.send_message(
+                text='\n\n'.join(text for _, text, _ in batch),
+                chat_id=chatId
+            )
+        except RetryAfter as err:
+            self.log.warning(f"Flood limit hit, pausing notifications for {err.retry_after} seconds")
+            with self.cond:
+                self.paused_until = time.monotonic() + err.retry_after
+            return
+        except (Unauthorized, BadRequest, ChatMigrated) as err:
+            self.log.warning(f"Dropping {len(batch)} notifications for chat {chatId}: {err}")
+        except Exception as err:
+            attempts = max(attempts for _, _, attempts in batch) + 1
+            if attempts < Notifier.MAX_ATTEMPTS:
+                self.log.warning(f"Couldn't notify chat {chatId} (attempt {attempts}): {err}")
+                self.store.retried([id for id, _, _ in batch])
+                with self.cond:
+                    queue = self.queues[chatId]
+                    for i, (id, text, _) in enumerate(batch):
+                        queue[i] = (id, text, attempts)
+                    self.ready_at[chatId] = time.monotonic() + min(2**attempts, Notifier.MAX_BACKOFF)
+                return
+            self.log.exception(f"Giving up on {len(batch)} notifications for chat {chatId}: {err}")
+        self.store.remove([id for id, _, _ in batch])
+        with self.cond:
+            queue = self.queues.pop(chatId)
+            for _ in batch:
+                queue.popleft()
+            if queue:
+                self.queues[chatId] = queue
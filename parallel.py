@@ -0,0 +1,163 @@
+import time
+import zlib
+import threading
+import multiprocessing
+import logger_config
+import clock
+import config
+from repository.market import MarketRepository
+from calculator import Calculator
+from vector_calculator import VectorCalculator
+from evaluator import Evaluator
+from exceptions import MissingCandlesException
+
+class EvaluationWorker:
+    def __init__(self, shard):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = MarketRepository(readonly=True)
+        if config.CALCULATOR_BACKEND == 'vector':
+            calculator = VectorCalculator(self.repository)
+        else:
+            calculator = Calculator(self.repository)
+        self.evaluator = Evaluator(
+            calculator=calculator,
+            visit_tokens=True,
+            states_filename=config.HANDLER_CACHE_DB_FILENAME.replace('.sqlite', f'.shard{shard}.sqlite')
+        )
+        self.plans = {}
+
+    def add(self, key, command):
+        try:
+            self.plans[key] = self.evaluator.compile(Evaluator.ALERT_PARSER.parse(command))
+        except Exception as err:
+            self.log.exception(f"Couldn't compile alert {key}: {err}")
+
+    def remove(self, key):
+        self.plans.pop(key, None)
+
+    def evaluate(self, keys, at, live):
+        self.repository.live = live
+        self.repository.revision += 1
+        triggered = []
+        missing = {}
+        failed = {}
+        timings = {}
+        for key in keys:
+            plan = self.plans.get(key)
+            if plan is None:
+                continue
+            started = time.perf_counter()
+            try:
+                if plan(at):
+                    triggered.append(key)
+            except MissingCandlesException as err:
+                missing[key] = (err.fsym, err.tsym, err.start, err.end, err.interval)
+            except Exception as err:
+                failed[key] = str(err)
+            timings[key] = time.perf_counter() - started
+        return triggered, missing, failed, timings
+
+    def checkpoint(self):
+        self.evaluator.checkpoint()
+
+    @staticmethod
+    def serve(shard, conn, source):
+        clock.install(source)
+        worker = EvaluationWorker(shard)
+        while True:
+            op, *args = conn.recv()
+            if op == 'add':
+                worker.add(*args)
+            elif op == 'remove':
+                worker.remove(*args)
+            elif op == 'evaluate':
+                conn.send(worker.evaluate(*args))
+            elif op == 'checkpoint':
+                worker.checkpoint()
+                conn.send(None)
+            elif op == 'stop':
+                worker.checkpoint()
+                worker.repository.close()
+                conn.send(None)
+                return
+
+class EvaluationPool:
+    def __init__(self, repository, workers=config.EVAL_WORKERS):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = repository
+        self.shards = {}
+        self.conns = []
+        self.procs = []
+        self.lock = threading.Lock()
+        self.replies = [threading.Lock() for _ in range(workers)]
+        context = multiprocessing.get_context('spawn')
+        for shard in range(workers):
+            conn, child = context.Pipe()
+            proc = context.Process(target=EvaluationWorker.serve, args=(shard, child, clock.CLOCK), daemon=True)
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+        self.log.info(f"Started {workers} evaluation workers")
+
+    @staticmethod
+    def shard(deps, workers):
+        fsym, tsym = min(deps.pairs, default=('', ''))
+        return zlib.crc32(MarketRepository.pair_key(fsym, tsym).encode()) % workers
+
+    def add(self, key, command, deps):
+        shard = EvaluationPool.shard(deps, len(self.conns))
+        with self.lock:
+            self.shards[key] = (shard, deps.pairs)
+            self.conns[shard].send(('add', key, command))
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.shards.pop(key, None)
+            if entry is not None:
+                self.conns[entry[0]].send(('remove', key))
+
+    def evaluate(self, keys, at):
+        triggered = []
+        missing = {}
+        failed = {}
+        timings = {}
+        with self.lock:
+            groups = {}
+            for key in keys:
+                entry = self.shards.get(key)
+                if entry is not None:
+                    groups.setdefault(entry[0], []).append((key, entry[1]))
+            live = dict(self.repository.live)
+            for shard, group in groups.items():
+                pairs = {MarketRepository.pair_key(*pair) for _, deps in group for pair in deps}
+                self.replies[shard].acquire()
+                self.conns[shard].send(('evaluate', [key for key, _ in group], at, {pair: live[pair] for pair in pairs if pair in live}))
+        for shard in groups:
+            try:
+                shard_triggered, shard_missing, shard_failed, shard_timings = self.conns[shard].recv()
+            finally:
+                self.replies[shard].release()
+            triggered += shard_triggered
+            missing.update(shard_missing)
+            failed.update(shard_failed)
+            timings.update(shard_timings)
+        return triggered, missing, failed, timings
+
+    def broadcast(self, message):
+        with self.lock:
+            for shard, conn in enumerate(self.conns):
+                self.replies[shard].acquire()
+                conn.send(message)
+        for shard, conn in enumerate(self.conns):
+            try:
+                conn.recv()
+            finally:
+                self.replies[shard].release()
+
+    def checkpoint(self):
+        self.broadcast(('checkpoint',))
+
+    def close(self):
+        self.broadcast(('stop',))
+        for proc in self.procs:
+            proc.join()
@@ -0,0 +1,91 @@
+import math
+from datetime import timedelta
+from lark import Tree
+import logger_config
+import config
+from dependencies import Dependencies
+from exceptions import PlanTooExpensiveException
+from repository.market import MarketRepository
+
+class Planner:
+    def __init__(self, repository, budget=config.MAX_PLAN_REQUESTS):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = repository
+        self.budget = budget
+
+    @staticmethod
+    def ranges(parsed):
+        ranges = {}
+        Planner.visit(parsed, 1, frozenset(), 0, ranges)
+        return ranges
+
+    @staticmethod
+    def need(ranges, fsym, tsym, interval, minutes):
+        key = (fsym, tsym, interval)
+        ranges[key] = max(ranges.get(key, 0), minutes)
+
+    @staticmethod
+    def visit(tree, frame, grids, offset, ranges):
+        if tree.data == 'price':
+            candle, pair = tree.children
+            fsym, tsym = str(pair.children[0]).upper(), str(pair.children[1]).upper()
+            partial = 1 if candle in ('price', 'close') else frame
+            Planner.need(ranges, fsym, tsym, 1, partial - 1)
+            if frame == 1:
+                Planner.need(ranges, fsym, tsym, 1, offset)
+                return
+            for grid in grids:
+                if grid % frame == 0:
+                    Planner.need(ranges, fsym, tsym, frame, offset)
+                else:
+                    Planner.need(ranges, fsym, tsym, 1, offset + frame)
+            return
+        interval = Dependencies.interval(tree)
+        if interval is not None:
+            frame, grids, offset = interval, grids | {interval}, offset + Dependencies.lags(tree)*interval
+        for child in tree.children:
+            if isinstance(child, Tree) and child.data not in Dependencies.INTERVALS:
+                Planner.visit(child, frame, grids, offset, ranges)
+
+    @staticmethod
+    def fetch_interval(interval):
+        return interval if interval in MarketRepository.INTERVALS else MarketRepository.source_interval(interval)
+
+    @staticmethod
+    def cost(ranges):
+        requests = 0
+        for (_, _, interval), minutes in ranges.items():
+            rows = minutes // Planner.fetch_interval(interval) + 2
+            requests += math.ceil(rows / MarketRepository.KLINES_LIMIT)
+        return requests
+
+    def check(self, parsed):
+        ranges = Planner.ranges(parsed)
+        cost = Planner.cost(ranges)
+        if cost > self.budget:
+            raise PlanTooExpensiveException(cost, self.budget)
+        return ranges
+
+    def prefetch(self, parsed, time):
+        ranges = self.check(parsed)
+        if self.repository.fetcher is None:
+            return ranges
+        end = int(time.replace(second=0, microsecond=0).timestamp())
+        requests = []
+        for (fsym, tsym, interval), minutes in ranges.items():
+            start = end - minutes*60
+            if interval == 1:
+                requests += self.repository.plan_range(fsym, tsym, start, end)
+                continue
+            step = interval*60
+            last = min(end - end % step, MarketRepository.closed_bucket(step))
+            if start - start % step <= last:
+                requests += self.repository.plan_candles(fsym, tsym, interval, start - start % step, last)
+        self.log.debug(f"Prefetching {len(requests)} windows for {len(ranges)} series")
+        errors = self.repository.fetch_many(requests)
+        if errors:
+            raise next(iter(errors.values()))
+        for (fsym, tsym, interval), minutes in ranges.items():
+            if interval != 1:
+                self.repository.get_candles(fsym, tsym, interval, time - timedelta(minutes=minutes), time)
+        return ranges
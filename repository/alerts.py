@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from sqlitedict import SqliteDict
+import logger_config
+
+class AlertStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS alerts (
+            chat_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            command TEXT NOT NULL,
+            next_eligible REAL NOT NULL,
+            PRIMARY KEY (chat_id, name)
+        );
+        CREATE INDEX IF NOT EXISTS alerts_next_eligible ON alerts (next_eligible);
+    """
+
+    UPSERT = (
+        'INSERT INTO alerts (chat_id, name, command, next_eligible) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(chat_id, name) DO UPDATE SET command = excluded.command, next_eligible = excluded.next_eligible'
+    )
+
+    def __init__(self, filename):
+        self.log = logger_config.get_logger(__name__)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(AlertStore.SCHEMA)
+
+    def put(self, chatId, name, command, next_eligible):
+        with self.lock, self.conn:
+            self.conn.execute(AlertStore.UPSERT, (chatId, name, command, next_eligible.timestamp()))
+
+    def get(self, chatId, name):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT command, next_eligible FROM alerts WHERE chat_id = ? AND name = ?',
+                (chatId, name)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], datetime.fromtimestamp(row[1])
+
+    def exists(self, chatId, name):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM alerts WHERE chat_id = ? AND name = ?', (chatId, name)
+            ).fetchone() is not None
+
+    def chat_alerts(self, chatId):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT name, command FROM alerts WHERE chat_id = ? ORDER BY rowid', (chatId,)
+            ).fetchall()
+
+    def all(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT chat_id, name, command, next_eligible FROM alerts').fetchall()
+        return [(chatId, name, command, datetime.fromtimestamp(ts)) for chatId, name, command, ts in rows]
+
+    def remove(self, chatId, name):
+        with self.lock, self.conn:
+            return self.conn.execute(
+                'DELETE FROM alerts WHERE chat_id = ? AND name = ?', (chatId, name)
+            ).rowcount > 0
+
+    def remove_chat(self, chatId):
+        with self.lock, self.conn:
+            names = [name for name, _ in self.chat_alerts(chatId)]
+            self.conn.execute('DELETE FROM alerts WHERE chat_id = ?', (chatId,))
+        return names
+
+    def set_next_eligible(self, updates):
+        if not updates:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'UPDATE alerts SET next_eligible = ? WHERE chat_id = ? AND name = ?',
+                ((until.timestamp(), chatId, name) for chatId, name, until in updates)
+            )
+
+    def count_chat(self, chatId):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM alerts WHERE chat_id = ?', (chatId,)).fetchone()[0]
+
+    def counts(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(DISTINCT chat_id), COUNT(*) FROM alerts').fetchone()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def migrate_sqlitedict(self, filename):
+        self.log.info(f"Migrating legacy alerts db {filename}")
+        legacy = SqliteDict(filename, flag='r')
+        rows = []
+        for chatId in legacy.get('chats', ()):
+            for name, (command, _, ts) in legacy.get(f'{chatId}-alerts', {}).items():
+                rows.append((chatId, str(name), command, ts.timestamp()))
+        with self.lock, self.conn:
+            self.conn.executemany(AlertStore.UPSERT, rows)
+        legacy.close()
+        os.rename(filename, f"{filename}.migrated")
+        self.log.info(f"Migrated {len(rows)} alerts from {filename}")
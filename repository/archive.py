@@ -0,0 +1,126 @@
+import os
+import bisect
+import collections
+import threading
+import numpy as np
+import config
+from repository.candles import CANDLE_COLUMNS, CANDLE_DTYPE
+
+class CandleArchive:
+    DAY = 24*60*60
+    ROWS = DAY // 60
+    SUFFIXES = {'.f4': np.float32, '.f8': np.float64}
+
+    def __init__(self, directory, dtype=config.ARCHIVE_DTYPE, max_open=config.ARCHIVE_OPEN_FILES):
+        self.directory = directory
+        self.suffix = '.f4' if np.dtype(dtype) == np.float32 else '.f8'
+        self.max_open = max_open
+        self.index = {}
+        self.maps = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+    def folder(self, pair):
+        return os.path.join(self.directory, pair.replace('/', '_'))
+
+    def days(self, pair):
+        folder = self.folder(pair)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self.lock:
+            cached = self.index.get(pair)
+            if cached is None or cached[0] != mtime:
+                days = {}
+                for name in os.listdir(folder) if mtime is not None else []:
+                    day, suffix = os.path.splitext(name)
+                    if suffix in CandleArchive.SUFFIXES:
+                        days[int(day)] = suffix
+                for key in [key for key in self.maps if key[0] == pair]:
+                    del self.maps[key]
+                cached = self.index[pair] = (mtime, sorted(days), days)
+            return cached[1:]
+
+    def path(self, pair, day, suffix):
+        return os.path.join(self.folder(pair), f"{day}{suffix}")
+
+    def open(self, pair, day):
+        with self.lock:
+            table = self.maps.get((pair, day))
+            if table is not None:
+                self.maps.move_to_end((pair, day))
+                return table
+            suffix = self.days(pair)[1][day]
+            table = np.memmap(
+                self.path(pair, day, suffix), dtype=CandleArchive.SUFFIXES[suffix], mode='r',
+                shape=(CandleArchive.ROWS, len(CANDLE_COLUMNS))
+            )
+            self.maps[(pair, day)] = table
+            while len(self.maps) > self.max_open:
+                self.maps.popitem(last=False)
+            return table
+
+    def sealed(self, pair, day):
+        return day in self.days(pair)[1]
+
+    def seal(self, pair, day, rows):
+        table = np.full((CandleArchive.ROWS, len(CANDLE_COLUMNS)), np.nan, dtype=CandleArchive.SUFFIXES[self.suffix])
+        with self.lock:
+            for part in (self.get_range(pair, day, day + CandleArchive.DAY - 60), rows):
+                pos = (part['ts'] - day) // 60
+                for i, name in enumerate(CANDLE_COLUMNS):
+                    table[pos, i] = part[name]
+            os.makedirs(self.folder(pair), exist_ok=True)
+            path = self.path(pair, day, self.suffix)
+            table.tofile(f"{path}.tmp")
+            self.drop(pair, day)
+            os.replace(f"{path}.tmp", path)
+            self.index.pop(pair, None)
+        return len(rows)
+
+    def get_range(self, pair, start, end):
+        parts = []
+        with self.lock:
+            days, _ = self.days(pair)
+            lo = bisect.bisect_left(days, start - start % CandleArchive.DAY)
+            hi = bisect.bisect_right(days, end)
+            for day in days[lo:hi]:
+                first = max(start - day, 0) // 60
+                view = self.open(pair, day)[first:min(end - day, CandleArchive.DAY - 60) // 60 + 1]
+                present = np.flatnonzero(~np.isnan(view[:, CANDLE_COLUMNS.index('close')]))
+                rows = np.empty(len(present), dtype=CANDLE_DTYPE)
+                rows['ts'] = day + (first + present)*60
+                for i, name in enumerate(CANDLE_COLUMNS):
+                    rows[name] = view[present, i]
+                parts.append(rows)
+        if not parts:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def get(self, pair, ts):
+        day = ts - ts % CandleArchive.DAY
+        with self.lock:
+            if not self.sealed(pair, day):
+                return None
+            row = self.open(pair, day)[(ts - day) // 60]
+        if np.isnan(row[CANDLE_COLUMNS.index('close')]):
+            return None
+        return tuple(row.tolist())
+
+    def drop(self, pair, day):
+        with self.lock:
+            days, suffixes = self.days(pair)
+            suffix = suffixes.pop(day, None)
+            if suffix is None:
+                return
+            days.remove(day)
+            self.maps.pop((pair, day), None)
+            os.remove(self.path(pair, day, suffix))
+
+    def drop_pair(self, pair):
+        with self.lock:
+            for day in list(self.days(pair)[0]):
+                self.drop(pair, day)
+            self.index.pop(pair, None)
+            if os.path.isdir(self.folder(pair)) and not os.listdir(self.folder(pair)):
+                os.rmdir(self.folder(pair))
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+import numpy as np
+from sqlitedict import SqliteDict
+import logger_config
+import config
+from repository.sqlite import enable_incremental_vacuum, incremental_vacuum
+
+CANDLE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+CANDLE_DTYPE = np.dtype([('ts', np.int64)] + [(name, np.float64) for name in CANDLE_COLUMNS])
+
+class CandleStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS candles (
+            pair TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (pair, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS pairs (
+            pair TEXT PRIMARY KEY,
+            last_available INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS coarse_candles (
+            pair TEXT NOT NULL,
+            interval INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            PRIMARY KEY (pair, interval, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS coverage (
+            pair TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            PRIMARY KEY (pair, start)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS candles_inserted AFTER INSERT ON candles BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'candles';
+        END;
+        CREATE TRIGGER IF NOT EXISTS candles_deleted AFTER DELETE ON candles BEGIN
+            UPDATE meta SET value = value - 1 WHERE key = 'candles';
+        END;
+    """
+
+    UPSERT = (
+        'INSERT INTO candles (pair, ts, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(pair, ts) DO UPDATE SET '
+        'open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close, volume = excluded.volume '
+        'WHERE (open, high, low, close, volume) IS NOT (excluded.open, excluded.high, excluded.low, excluded.close, excluded.volume)'
+    )
+
+    COARSE_UPSERT = (
+        'INSERT INTO coarse_candles (pair, interval, ts, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(pair, interval, ts) DO UPDATE SET '
+        'open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close, volume = excluded.volume'
+    )
+
+    def __init__(self, filename, readonly=False):
+        self.log = logger_config.get_logger(__name__)
+        self.lock = threading.RLock()
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(filename))}?mode=ro', uri=True, check_same_thread=False)
+            self.conn.execute(f'PRAGMA cache_size=-{config.CANDLES_CACHE_KIB}')
+            return
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        if not enable_incremental_vacuum(self.conn):
+            self.log.warning(f"{filename} does not use incremental auto-vacuum, run `python -m repository.sqlite {filename}` once while the bot is stopped")
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA cache_size=-{config.CANDLES_CACHE_KIB}')
+        self.conn.executescript(CandleStore.SCHEMA)
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'candles'").fetchone() is None:
+                self.log.info("Counting stored candles into the metadata table")
+                self.conn.execute("INSERT INTO meta (key, value) SELECT 'candles', COUNT(*) FROM candles")
+
+    def add(self, pair, rows, last=None):
+        if not rows:
+            return 0
+        if last is None:
+            last = max(row[0] for row in rows)
+        with self.lock, self.conn:
+            changed = self.conn.executemany(CandleStore.UPSERT, ([pair] + row for row in rows)).rowcount
+            self.conn.execute(
+                'INSERT INTO pairs (pair, last_available) VALUES (?, ?) '
+                'ON CONFLICT(pair) DO UPDATE SET last_available = max(last_available, excluded.last_available)',
+                (pair, last)
+            )
+        return changed
+
+    def get(self, pair, ts):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT open, high, low, close, volume FROM candles WHERE pair = ? AND ts = ?',
+                (pair, ts)
+            ).fetchone()
+
+    def get_range(self, pair, start, end):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT ts, open, high, low, close, volume FROM candles WHERE pair = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                (pair, start, end)
+            ).fetchall()
+        return np.array(rows, dtype=CANDLE_DTYPE)
+
+    def last_available(self, pair):
+        with self.lock:
+            row = self.conn.execute('SELECT last_available FROM pairs WHERE pair = ?', (pair,)).fetchone()
+        return row[0] if row else None
+
+    def pairs(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT pair FROM pairs')]
+
+    def oldest(self, pair):
+        with self.lock:
+            return self.conn.execute('SELECT MIN(ts) FROM candles WHERE pair = ?', (pair,)).fetchone()[0]
+
+    @staticmethod
+    def aggregate(rows, interval):
+        if not len(rows):
+            return []
+        buckets = rows['ts'] - rows['ts'] % interval
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(rows)] - 1
+        return list(zip(
+            buckets[starts].tolist(),
+            rows['open'][starts].tolist(),
+            np.maximum.reduceat(rows['high'], starts).tolist(),
+            np.minimum.reduceat(rows['low'], starts).tolist(),
+            rows['close'][ends].tolist(),
+            np.add.reduceat(rows['volume'], starts).tolist()
+        ))
+
+    def downsample(self, pair, start, end, interval):
+        rows = self.get_range(pair, start, end-1)
+        if not len(rows):
+            return 0
+        with self.lock, self.conn:
+            self.conn.executemany(CandleStore.COARSE_UPSERT, ((pair, interval) + row for row in CandleStore.aggregate(rows, interval)))
+            self.conn.execute('DELETE FROM candles WHERE pair = ? AND ts >= ? AND ts < ?', (pair, start, end))
+        return len(rows)
+
+    def add_coarse(self, pair, interval, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(CandleStore.COARSE_UPSERT, ((pair, interval) + tuple(row) for row in rows))
+
+    def get_coarse(self, pair, interval, start, end):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT ts, open, high, low, close, volume FROM coarse_candles '
+                'WHERE pair = ? AND interval = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+                (pair, interval, start, end)
+            ).fetchall()
+        return np.array(rows, dtype=CANDLE_DTYPE)
+
+    def delete(self, pair, start, end):
+        with self.lock, self.conn:
+            return self.conn.execute(
+                'DELETE FROM candles WHERE pair = ? AND ts >= ? AND ts < ?', (pair, start, end)
+            ).rowcount
+
+    def get_coverage(self, pair):
+        with self.lock:
+            return self.conn.execute('SELECT start, end FROM coverage WHERE pair = ? ORDER BY start', (pair,)).fetchall()
+
+    def set_coverage(self, pair, ranges):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM coverage WHERE pair = ?', (pair,))
+            self.conn.executemany('INSERT INTO coverage (pair, start, end) VALUES (?, ?, ?)', ((pair, start, end) for start, end in ranges))
+
+    def candle_runs(self, pair):
+        with self.lock:
+            ts = np.array([row[0] for row in self.conn.execute('SELECT ts FROM candles WHERE pair = ? ORDER BY ts', (pair,))], dtype=np.int64)
+        if not len(ts):
+            return []
+        breaks = np.flatnonzero(np.diff(ts) != 60)
+        starts = np.r_[ts[0], ts[breaks+1]]
+        ends = np.r_[ts[breaks], ts[-1]]
+        return list(zip(starts.tolist(), ends.tolist()))
+
+    def drop_pair(self, pair):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM candles WHERE pair = ?', (pair,))
+            self.conn.execute('DELETE FROM coarse_candles WHERE pair = ?', (pair,))
+            self.conn.execute('DELETE FROM coverage WHERE pair = ? OR pair LIKE ?', (pair, f'{pair}@%'))
+            self.conn.execute('DELETE FROM pairs WHERE pair = ?', (pair,))
+
+    def vacuum(self, pages):
+        with self.lock:
+            return incremental_vacuum(self.conn, pages)
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT value FROM meta WHERE key = 'candles'").fetchone()[0]
+
+    def count_pairs(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pairs').fetchone()[0]
+
+    def migrate_sqlitedict(self, filename, batch_size=10000, stopping=None):
+        self.log.info(f"Migrating legacy prices db {filename}")
+        legacy = SqliteDict(filename, flag='r')
+        batches = {}
+        total = 0
+        for key, value in legacy.items():
+            pair, _, suffix = key.rpartition('@')
+            if suffix == 'last_available':
+                continue
+            rows = batches.setdefault(pair, [])
+            rows.append([int(suffix)] + [float(value[name]) for name in CANDLE_COLUMNS])
+            if len(rows) >= batch_size:
+                self.add(pair, rows)
+                total += len(rows)
+                batches[pair] = []
+                if stopping is not None and stopping.is_set():
+                    legacy.close()
+                    self.log.info(f"Stopped migrating {filename} after {total} minute prices, it resumes on the next start")
+                    return
+        for pair, rows in batches.items():
+            self.add(pair, rows)
+            total += len(rows)
+        legacy.close()
+        os.rename(filename, f"{filename}.migrated")
+        self.log.info(f"Migrated {total} minute prices from {filename}")
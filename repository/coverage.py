@@ -0,0 +1,88 @@
+import threading
+
+class CoverageIndex:
+    STEP = 60
+
+    def __init__(self, store, cached=True):
+        self.store = store
+        self.cached = cached
+        self.ranges = {}
+        self.lock = threading.RLock()
+
+    def covered(self, pair):
+        ranges = self.ranges.get(pair)
+        if ranges is not None:
+            return ranges
+        ranges = self.store.get_coverage(pair)
+        if not ranges:
+            ranges = self.store.candle_runs(pair)
+            if ranges and self.cached:
+                self.store.set_coverage(pair, ranges)
+        if self.cached:
+            self.ranges[pair] = ranges
+        return ranges
+
+    def update(self, pair, ranges):
+        self.store.set_coverage(pair, ranges)
+        if self.cached:
+            self.ranges[pair] = ranges
+
+    def add(self, pair, start, end, step=STEP):
+        with self.lock:
+            merged = []
+            for covered_start, covered_end in self.covered(pair):
+                if covered_end + step < start or covered_start > end + step:
+                    merged.append((covered_start, covered_end))
+                else:
+                    start = min(start, covered_start)
+                    end = max(end, covered_end)
+            merged.append((start, end))
+            self.update(pair, sorted(merged))
+
+    def remove(self, pair, start, end, step=STEP):
+        with self.lock:
+            remaining = []
+            for covered_start, covered_end in self.covered(pair):
+                if covered_end < start or covered_start > end:
+                    remaining.append((covered_start, covered_end))
+                    continue
+                if covered_start < start:
+                    remaining.append((covered_start, start - step))
+                if covered_end > end:
+                    remaining.append((end + step, covered_end))
+            self.update(pair, remaining)
+
+    def discard(self, pair):
+        with self.lock:
+            for key in [key for key in self.ranges if key == pair or key.startswith(f'{pair}@')]:
+                del self.ranges[key]
+
+    def missing(self, pair, start, end, step=STEP):
+        with self.lock:
+            ranges = self.covered(pair)
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in ranges:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start - step))
+            cursor = covered_end + step
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    @staticmethod
+    def plan(gaps, limit, step=STEP):
+        span = (limit - 1)*step
+        windows = []
+        for start, end in gaps:
+            if windows and end <= windows[-1][0] + span:
+                windows[-1] = (windows[-1][0], end)
+                continue
+            while start <= end:
+                windows.append((start, min(end, start + span)))
+                start = windows[-1][1] + step
+        return windows
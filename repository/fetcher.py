@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import threading
+import time
+from secrets import BINANCE_API_KEY, BINANCE_SECRET_KEY
+from binance import AsyncClient
+from binance.exceptions import BinanceAPIException
+import config
+import logger_config
+import metrics
+
+class WeightBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.minute = int(time.time())//60
+
+    def refresh(self):
+        minute = int(time.time())//60
+        if minute != self.minute:
+            self.minute = minute
+            self.used = 0
+
+    async def acquire(self, weight):
+        while True:
+            self.refresh()
+            if self.used + weight <= self.limit:
+                self.used += weight
+                return
+            await asyncio.sleep(60 - time.time() % 60)
+
+    def sync(self, used):
+        self.refresh()
+        if used is not None:
+            self.used = max(self.used, int(used))
+
+RESPONSE = contextvars.ContextVar('binance_response', default=None)
+
+class KlineClient(AsyncClient):
+    async def _handle_response(self, response):
+        RESPONSE.set(response)
+        return await super()._handle_response(response)
+
+class KlineFetcher:
+    KLINES_WEIGHT = 2
+    MAX_RETRIES = 3
+
+    def __init__(self):
+        self.log = logger_config.get_logger(__name__)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='kline-fetcher', daemon=True)
+        self.thread.start()
+        self.client = self.run(self.create_client())
+        self.budget = WeightBudget(config.BINANCE_WEIGHT_LIMIT)
+        self.inflight = {}
+
+    async def create_client(self):
+        client = KlineClient(BINANCE_API_KEY, BINANCE_SECRET_KEY, loop=self.loop)
+        if config.BINANCE_API_URL:
+            client.API_URL = config.BINANCE_API_URL
+        return client
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, symbol, start, end, limit, interval=AsyncClient.KLINE_INTERVAL_1MINUTE):
+        return asyncio.run_coroutine_threadsafe(self.fetch(symbol, start, end, limit, interval), self.loop)
+
+    def close(self):
+        self.run(self.client.close_connection())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def fetch(self, symbol, start, end, limit, interval):
+        key = (symbol, interval, start, end)
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.loop.create_task(self.request(symbol, start, end, limit, interval))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def request(self, symbol, start, end, limit, interval):
+        for attempt in range(KlineFetcher.MAX_RETRIES):
+            await self.budget.acquire(KlineFetcher.KLINES_WEIGHT)
+            started = time.time()
+            metrics.BINANCE_SYMBOL_REQUESTS.inc(symbol=symbol)
+            try:
+                data = await self.client.get_klines(
+                    symbol=symbol,
+                    interval=interval,
+                    startTime=int(start.timestamp())*1000,
+                    endTime=int(end.timestamp())*1000,
+                    limit=limit
+                )
+            except BinanceAPIException as err:
+                metrics.BINANCE_SECONDS.observe(time.time()-started)
+                if err.status_code not in (418, 429):
+                    metrics.BINANCE_REQUESTS.inc(status='error')
+                    raise
+                metrics.BINANCE_REQUESTS.inc(status='rate_limited')
+                if attempt+1 == KlineFetcher.MAX_RETRIES:
+                    raise
+                retry_after = int(err.response.headers.get('Retry-After', 60))
+                self.log.warning(f"Binance rate limit hit fetching {symbol}, retrying in {retry_after} seconds")
+                await asyncio.sleep(retry_after)
+                continue
+            except Exception:
+                metrics.BINANCE_SECONDS.observe(time.time()-started)
+                metrics.BINANCE_REQUESTS.inc(status='error')
+                raise
+            metrics.BINANCE_SECONDS.observe(time.time()-started)
+            metrics.BINANCE_REQUESTS.inc(status='ok')
+            self.budget.sync(RESPONSE.get().headers.get('x-mbx-used-weight-1m'))
+            self.log.debug(f"Fetched {len(data)} {interval} klines of {symbol} in {time.time()-started:.3f} seconds")
+            return data
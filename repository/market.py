@@ -1,77 +1,287 @@
-from time import time
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 import math
 import collections
+import concurrent.futures
 import os
-from exceptions import InvalidPairException
+import threading
+import numpy as np
+from exceptions import InvalidPairException, MissingCandlesException, DeadlineExceededException
 # from secrets import CC_API_KEY
 # os.environ['CRYPTOCOMPARE_API_KEY'] = CC_API_KEY
 # from cryptocompare import cryptocompare
-from secrets import BINANCE_API_KEY, BINANCE_SECRET_KEY
-from binance import Client, ThreadedWebsocketManager, ThreadedDepthCacheManager
-from config import PRICES_DB_FILENAME
-from sqlitedict import SqliteDict
+from binance.exceptions import BinanceAPIException
+from config import PRICES_DB_FILENAME, CANDLES_DB_FILENAME, ARCHIVE_DIRNAME
+from repository.candles import CandleStore, CANDLE_COLUMNS, CANDLE_DTYPE
+from repository.fetcher import KlineFetcher
+from repository.coverage import CoverageIndex
+from repository.archive import CandleArchive
+from cache import TieredCache
+import clock
+import config
+import deadline
 import logger_config
 
 class MarketRepository(object):
-    def __init__(self):
+    KLINES_LIMIT = 1000
+    INTERVALS = {
+        1: '1m', 3: '3m', 5: '5m', 15: '15m', 30: '30m', 60: '1h',
+        120: '2h', 240: '4h', 360: '6h', 480: '8h', 720: '12h', 1440: '1d'
+    }
+
+    def __init__(self, readonly=False, fetcher=None):
         self.log = logger_config.get_logger(__name__)
         # cryptocompare._set_api_key_parameter(CC_API_KEY)
-        self.db = SqliteDict(PRICES_DB_FILENAME)
-        self.bnb = Client(BINANCE_API_KEY, BINANCE_SECRET_KEY)
-        tot_pairs = sum(1 for k in self.db.keys() if k.endswith("@last_available"))
-        self.log.info(f"Loaded market db with {len(self.db)-tot_pairs} minute prices loaded from {tot_pairs} pairs")
+        self.db = CandleStore(CANDLES_DB_FILENAME, readonly)
+        self.archive = CandleArchive(ARCHIVE_DIRNAME)
+        self.coverage = CoverageIndex(self.db, cached=not readonly)
+        self.fetcher = None
+        if not readonly:
+            self.fetcher = fetcher if fetcher is not None else KlineFetcher()
+        self.local = threading.local()
+        self.live = {}
+        self.revision = 0
+        self.cache = TieredCache(max_bytes=config.PRICES_CACHE_MAX_BYTES)
+        self.log.info(f"Loaded market db with {self.db.count()} minute prices loaded from {self.db.count_pairs()} pairs")
         # self.symbols = cryptocompare.get_coin_list()
 
+    def migrate(self, stopping=None):
+        if os.path.exists(PRICES_DB_FILENAME):
+            self.db.migrate_sqlitedict(PRICES_DB_FILENAME, stopping=stopping)
+
+    @staticmethod
+    def pair_key(fsym, tsym):
+        return f'{fsym}/{tsym}'
+
+    @staticmethod
+    def series_key(pair, interval):
+        return pair if interval == 1 else f'{pair}@{interval}'
+
+    @staticmethod
+    def source_interval(interval):
+        return max(native for native in MarketRepository.INTERVALS if native < interval and interval % native == 0)
+
+    def last_available(self, fsym, tsym):
+        last = self.db.last_available(MarketRepository.pair_key(fsym, tsym))
+        return datetime.fromtimestamp(last) if last is not None else None
+
+    @staticmethod
+    def closed_minute():
+        now = int(clock.time())
+        return now - now % 60 - 60
+
+    @staticmethod
+    def closed_bucket(step):
+        edge = MarketRepository.closed_minute() + 60
+        return edge - edge % step - step
+
+    @staticmethod
+    def closed(interval, time):
+        step = interval*60
+        ts = int(time.timestamp())
+        return ts % step == step - 60 and ts <= MarketRepository.closed_minute()
+
+    def plan(self, fsym, tsym, start, end, interval=1):
+        step = interval*60
+        gaps = self.coverage.missing(MarketRepository.series_key(MarketRepository.pair_key(fsym, tsym), interval), start, end, step)
+        return [(fsym, tsym, s, e, interval) for s, e in CoverageIndex.plan(gaps, MarketRepository.KLINES_LIMIT, step)]
+
+    def fetch_many(self, requests):
+        futures = []
+        for fsym, tsym, start, end, interval in requests:
+            start, end = datetime.fromtimestamp(start), datetime.fromtimestamp(end)
+            name = MarketRepository.INTERVALS[interval]
+            self.log.info(f"Querying Binance for {name} {fsym}{tsym} start={start}, end={end}")
+            futures.append((fsym, tsym, start, end, interval, self.fetcher.submit(f"{fsym}{tsym}", start, end, MarketRepository.KLINES_LIMIT, name)))
+        errors = {}
+        for fsym, tsym, start, end, interval, future in futures:
+            try:
+                covered = (int(start.timestamp()), int(end.timestamp()))
+                data = future.result(timeout=deadline.remaining())
+                if interval == 1:
+                    self.add_data(fsym, tsym, data, covered)
+                else:
+                    self.add_candles(fsym, tsym, interval, data, covered)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                try:
+                    deadline.check()
+                except DeadlineExceededException as err:
+                    errors[(fsym, tsym)] = err
+            except BinanceAPIException as err:
+                errors[(fsym, tsym)] = InvalidPairException(fsym, tsym) if err.code == -1121 else err
+            except Exception as err:
+                errors[(fsym, tsym)] = err
+        return errors
+
     def fetch_data(self, fsym, tsym, time):
-        last_key = f'{fsym}/{tsym}@last_available'
-        if last_key in self.db and time>self.db[last_key] and time-self.db[last_key] < timedelta(minutes=500):
-            self.log.debug(f'Querying last minutes to binance for symbol {fsym}{tsym}')
-            start = self.db[last_key]
-            end = min(datetime.now(), start + timedelta(minutes=501))
-            limit=500+50
+        if self.fetcher is None:
+            raise MissingCandlesException(fsym, tsym, time, time)
+        ts = int(time.timestamp())
+        span = (MarketRepository.KLINES_LIMIT - 1)*60
+        gaps = self.coverage.missing(MarketRepository.pair_key(fsym, tsym), ts - span, ts + span)
+        gap = next((gap for gap in gaps if gap[0] <= ts <= gap[1]), None)
+        if gap is None:
+            return
+        start = max(gap[0], ts - span)
+        errors = self.fetch_many([(fsym, tsym, start, min(gap[1], start + span), 1)])
+        if errors:
+            raise errors[(fsym, tsym)]
+
+    def add_data(self, fsym, tsym, data, covered=None):
+        pair = MarketRepository.pair_key(fsym, tsym)
+        if data:
+            points = np.array([point[1:len(CANDLE_COLUMNS)+1] for point in data], dtype=np.float64)
+            ts = np.array([point[0] for point in data], dtype=np.int64)//1000
+            rows = np.column_stack((ts, points)).tolist()
+            for row in rows:
+                row[0] = int(row[0])
+            last = int(ts.max())
+            changed = self.db.add(pair, rows, last)
+            self.log.debug(f"Stored {changed} new or changed candles out of {len(rows)} for {pair}")
+            for row in rows:
+                self.cache.discard((pair, row[0]))
+            self.revision += 1
+        if covered is not None:
+            start, end = covered
+            end = min(end, MarketRepository.closed_minute())
+            if start <= end:
+                self.coverage.add(pair, start, end)
+
+    def add_candles(self, fsym, tsym, interval, data, covered):
+        pair = MarketRepository.pair_key(fsym, tsym)
+        step = interval*60
+        start, end = covered
+        end = min(end, MarketRepository.closed_bucket(step))
+        rows = [
+            [point[0]//1000] + [float(value) for value in point[1:len(CANDLE_COLUMNS)+1]]
+            for point in data if point[0]//1000 <= end
+        ]
+        self.db.add_coarse(pair, step, rows)
+        self.log.debug(f"Stored {len(rows)} {interval}m candles for {pair}")
+        if start <= end:
+            self.coverage.add(MarketRepository.series_key(pair, interval), start, end, step)
+
+    def stored(self, pair, ts):
+        row = self.db.get(pair, ts)
+        if row is None:
+            row = self.archive.get(pair, ts)
+        return row
+
+    def stored_range(self, pair, start, end):
+        archived = self.archive.get_range(pair, start, end)
+        rows = self.db.get_range(pair, start, end)
+        if not len(archived):
+            return rows
+        if not len(rows):
+            return archived
+        rows = np.concatenate([archived, rows])
+        rows = rows[np.argsort(rows['ts'], kind='stable')]
+        return rows[np.r_[rows['ts'][1:] != rows['ts'][:-1], True]]
+
+    def rollup(self, pair, interval, source, start, end):
+        step = interval*60
+        if source == 1:
+            rows = self.stored_range(pair, start, end + step - 60)
         else:
-            self.log.debug(f'Long querying to binance for symbol {fsym}{tsym}, datetime={time}, last_key={last_key}')
-            if last_key in self.db:
-                self.log.debug(f"result={self.db[last_key]}")
-                self.log.debug(f"result={time>self.db[last_key] and time-self.db[last_key] < timedelta(minutes=500)}")
-                self.log.debug(f"result={time-self.db[last_key] < timedelta(minutes=500)}")
-                self.log.debug(f"result={time-self.db[last_key]}")
-                self.log.debug(f"result={timedelta(minutes=500)}")
-            if time.hour>=12:
-                start = time.replace(hour=12)
+            rows = self.db.get_coarse(pair, source*60, start, end + step - source*60)
+        self.db.add_coarse(pair, step, CandleStore.aggregate(rows, step))
+        self.coverage.add(MarketRepository.series_key(pair, interval), start, end, step)
+
+    def plan_candles(self, fsym, tsym, interval, start, end):
+        pair = MarketRepository.pair_key(fsym, tsym)
+        step = interval*60
+        requests = []
+        for gap_start, gap_end in self.coverage.missing(MarketRepository.series_key(pair, interval), start, end, step):
+            if not self.coverage.missing(pair, gap_start, gap_end + step - 60):
+                continue
+            if interval in MarketRepository.INTERVALS:
+                windows = CoverageIndex.plan([(gap_start, gap_end)], MarketRepository.KLINES_LIMIT, step)
+                requests += [(fsym, tsym, s, e, interval) for s, e in windows]
             else:
-                start = time.replace(hour=0)
-            end = start+timedelta(hours=12)+timedelta(minutes=1)
-            limit=12*60+1+10
-        assert limit<=1000
-        self.log.info(f"Querying Binance for {fsym}{tsym} start={start}, end={end}")
-        data = self.bnb.get_historical_klines(
-                f"{fsym}{tsym}",
-                Client.KLINE_INTERVAL_1MINUTE,
-                int(start.timestamp())*1000,
-                int(end.timestamp())*1000,
-                limit=limit
+                source = MarketRepository.source_interval(interval)
+                requests += self.plan_candles(fsym, tsym, source, gap_start, gap_end + step - source*60)
+        return requests
+
+    def ensure_candles(self, fsym, tsym, interval, start, end):
+        pair = MarketRepository.pair_key(fsym, tsym)
+        series = MarketRepository.series_key(pair, interval)
+        step = interval*60
+        gaps = self.coverage.missing(series, start, end, step)
+        if not gaps:
+            return
+        if self.fetcher is None:
+            raise MissingCandlesException(
+                fsym, tsym, datetime.fromtimestamp(gaps[0][0]), datetime.fromtimestamp(gaps[0][1] + step - 60), interval
             )
-        self.add_data(fsym, tsym, data)
-
-    def add_data(self, fsym, tsym, data):
-        mx = 0
-        for point in data:
-            time = point[0]//1000
-            key = f"{fsym}/{tsym}@{time}"
-            mx = max(mx, time)
-            cols = "open,high,low,close,volume".split(',')
-            self.db[key] = {
-                name: float(point[pos+1]) for pos,name in enumerate(cols)
-            }
-        last_key = f'{fsym}/{tsym}@last_available'
-        end = datetime.fromtimestamp(mx)
-        if last_key in self.db:
-            self.db[last_key] = max(self.db[last_key], end)
-        else:
-            self.db[last_key] = end
-        self.db.commit()
+        errors = self.fetch_many(self.plan_candles(fsym, tsym, interval, start, end))
+        if errors:
+            raise errors[(fsym, tsym)]
+        for gap_start, gap_end in self.coverage.missing(series, start, end, step):
+            if not self.coverage.missing(pair, gap_start, gap_end + step - 60):
+                self.rollup(pair, interval, 1, gap_start, gap_end)
+            elif interval not in MarketRepository.INTERVALS:
+                source = MarketRepository.source_interval(interval)
+                self.ensure_candles(fsym, tsym, source, gap_start, gap_end + step - source*60)
+                self.rollup(pair, interval, source, gap_start, gap_end)
+
+    def get_candles(self, fsym, tsym, interval, start, end):
+        if interval == 1:
+            return self.get_range(fsym, tsym, start, end)
+        step = interval*60
+        start = int(start.timestamp())
+        start -= start % step
+        end = int(end.timestamp())
+        end = min(end - end % step, MarketRepository.closed_bucket(step))
+        if start > end:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        self.ensure_candles(fsym, tsym, interval, start, end)
+        return self.db.get_coarse(MarketRepository.pair_key(fsym, tsym), step, start, end)
+
+    def get_candle(self, fsym, tsym, interval, time):
+        time = time.replace(second=0, microsecond=0)
+        if interval == 1:
+            return self.get_values(fsym, tsym, time)
+        pair = MarketRepository.pair_key(fsym, tsym)
+        step = interval*60
+        ts = int(time.timestamp())
+        bucket = ts - ts % step
+        if MarketRepository.closed(interval, time):
+            values = self.get_preloaded(fsym, tsym, interval, time)
+            if values is not None:
+                return values
+            values = self.cache.get((pair, interval, bucket))
+            if values is not None:
+                return values
+            rows = self.db.get_coarse(pair, step, bucket, bucket)
+            if not len(rows):
+                span = (MarketRepository.KLINES_LIMIT - 1)*step
+                gaps = self.coverage.missing(MarketRepository.series_key(pair, interval), bucket - span, bucket + span, step)
+                gap = next((gap for gap in gaps if gap[0] <= bucket <= gap[1]), None)
+                if gap is not None:
+                    start = max(gap[0], bucket - span)
+                    self.ensure_candles(fsym, tsym, interval, start, min(gap[1], start + span, MarketRepository.closed_bucket(step)))
+                rows = self.db.get_coarse(pair, step, bucket, bucket)
+            if len(rows):
+                values = {name: float(rows[name][0]) for name in CANDLE_COLUMNS}
+                self.cache.put((pair, interval, bucket), values)
+                return values
+        values = dict(self.get_values(fsym, tsym, time))
+        if ts > bucket:
+            rows = self.get_range(fsym, tsym, datetime.fromtimestamp(bucket), time - timedelta(minutes=1))
+            if len(rows):
+                values['open'] = float(rows['open'][0])
+                values['high'] = max(float(rows['high'].max()), values['high'])
+                values['low'] = min(float(rows['low'].min()), values['low'])
+                values['volume'] += float(rows['volume'].sum())
+        return values
+
+    def set_live(self, fsym, tsym, point):
+        self.live[MarketRepository.pair_key(fsym, tsym)] = (
+            point[0]//1000,
+            {name: float(point[pos+1]) for pos,name in enumerate(CANDLE_COLUMNS)}
+        )
+        self.revision += 1
 
     # def fetch_data_cc(self, fsym, tsym, time):
     #     data = cryptocompare.get_historical_price_minute(fsym, tsym, limit=2000, exchange='CCCAGG', toTs=time)
@@ -82,13 +292,102 @@ class MarketRepository(object):
     #         self.db[key] = point
     #     self.db.commit()
 
+    def plan_range(self, fsym, tsym, start, end):
+        closed = MarketRepository.closed_minute()
+        requests = self.plan(fsym, tsym, start, min(end, closed))
+        if end > closed and self.db.get(MarketRepository.pair_key(fsym, tsym), end) is None:
+            if requests and end - requests[-1][2] < MarketRepository.KLINES_LIMIT*60:
+                requests[-1] = (fsym, tsym, requests[-1][2], end, 1)
+            else:
+                requests.append((fsym, tsym, max(start, closed + 60), end, 1))
+        return requests
+
+    def get_range(self, fsym, tsym, start, end):
+        pair = MarketRepository.pair_key(fsym, tsym)
+        start = int(start.replace(second=0, microsecond=0).timestamp())
+        end = int(min(end, clock.now()).replace(second=0, microsecond=0).timestamp())
+        requests = self.plan_range(fsym, tsym, start, end)
+        if requests:
+            if self.fetcher is None:
+                raise MissingCandlesException(fsym, tsym, datetime.fromtimestamp(start), datetime.fromtimestamp(end))
+            errors = self.fetch_many(requests)
+            if errors:
+                raise errors[(fsym, tsym)]
+        return self.stored_range(pair, start, end)
+
+    @contextmanager
+    def preload(self, start, end, interval=1):
+        outer = getattr(self.local, 'window', None)
+        if outer is not None and outer[0] <= start and end <= outer[1] and outer[2] == interval:
+            yield
+            return
+        self.local.window = (start, end, interval, {})
+        try:
+            yield
+        finally:
+            self.local.window = outer
+
+    def get_preloaded(self, fsym, tsym, interval, time):
+        window = getattr(self.local, 'window', None)
+        if window is None or window[2] != interval or not window[0] <= time <= window[1]:
+            return None
+        start, end, _, loaded = window
+        pair = MarketRepository.pair_key(fsym, tsym)
+        if pair not in loaded:
+            loaded[pair] = self.get_candles(fsym, tsym, interval, start, end)
+        rows = loaded[pair]
+        ts = int(time.timestamp())
+        ts -= ts % (interval*60)
+        pos = np.searchsorted(rows['ts'], ts)
+        if pos == len(rows) or rows['ts'][pos] != ts:
+            return None
+        return {name: float(rows[name][pos]) for name in CANDLE_COLUMNS}
+
+    def poll(self, pairs, time):
+        ts = int(time.timestamp())
+        ready = set()
+        requests = []
+        for fsym, tsym in pairs:
+            pair = MarketRepository.pair_key(fsym, tsym)
+            live = self.live.get(pair)
+            if live is not None and live[0] >= ts:
+                ready.add((fsym, tsym))
+            elif live is not None and clock.now() - time < timedelta(seconds=config.STREAM_GRACE_SECONDS):
+                continue
+            elif self.db.get(pair, ts) is not None or not self.coverage.missing(pair, ts, ts):
+                ready.add((fsym, tsym))
+            else:
+                requests += self.plan(fsym, tsym, ts - (MarketRepository.KLINES_LIMIT - 1)*60, ts)
+        errors = self.fetch_many(requests)
+        ready |= {(fsym, tsym) for fsym, tsym, _, _, _ in requests if (fsym, tsym) not in errors}
+        return ready, errors
+
+    def close(self):
+        if self.fetcher is not None:
+            self.fetcher.close()
+
     def get_values(self, fsym, tsym, time):
         time = time.replace(second=0, microsecond=0)
-        key = f'{fsym}/{tsym}@{int(time.timestamp())}'
-        if key not in self.db:
+        values = self.get_preloaded(fsym, tsym, 1, time)
+        if values is not None:
+            return values
+        pair = MarketRepository.pair_key(fsym, tsym)
+        ts = int(time.timestamp())
+        live = self.live.get(pair)
+        if live is not None and live[0] == ts:
+            return live[1]
+        values = self.cache.get((pair, ts))
+        if values is not None:
+            return values
+        row = self.stored(pair, ts)
+        if row is None:
             self.fetch_data(fsym, tsym, time)
-        assert key in self.db, f"Couldn't get price for {key}"
-        return self.db[key]
+            row = self.stored(pair, ts)
+        assert row is not None, f"Couldn't get price for {pair}@{ts}"
+        values = dict(zip(CANDLE_COLUMNS, row))
+        if self.fetcher is not None or ts < MarketRepository.closed_minute() - 60:
+            self.cache.put((pair, ts), values)
+        return values
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+import logger_config
+
+class NotificationStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, filename):
+        self.log = logger_config.get_logger(__name__)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(NotificationStore.SCHEMA)
+
+    def add(self, messages):
+        ids = []
+        with self.lock, self.conn:
+            for chatId, text in messages:
+                cursor = self.conn.execute('INSERT INTO notifications (chat_id, text) VALUES (?, ?)', (chatId, text))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def pending(self):
+        with self.lock:
+            return self.conn.execute('SELECT id, chat_id, text, attempts FROM notifications ORDER BY id').fetchall()
+
+    def retried(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany('UPDATE notifications SET attempts = attempts + 1 WHERE id = ?', ((i,) for i in ids))
+
+    def remove(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM notifications WHERE id = ?', ((i,) for i in ids))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM notifications').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
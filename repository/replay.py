@@ -0,0 +1,90 @@
+import os
+import threading
+from concurrent.futures import Future
+import numpy as np
+from binance.exceptions import BinanceAPIException
+import clock
+import logger_config
+import metrics
+
+class ReplayFetcher:
+    UNITS = {'m': 60, 'h': 60*60, 'd': 24*60*60}
+    INVALID_SYMBOL = '{"code": -1121, "msg": "Invalid symbol."}'
+
+    def __init__(self, directory):
+        self.log = logger_config.get_logger(__name__)
+        self.directory = directory
+        self.klines = {}
+        self.inflight = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def symbols(directory):
+        return sorted(os.path.splitext(name)[0] for name in os.listdir(directory) if name.endswith('.csv'))
+
+    @staticmethod
+    def read(path):
+        with open(path) as fp:
+            lines = [line for line in fp if line[:1].isdigit()]
+        table = np.loadtxt(lines, delimiter=',', usecols=range(6), ndmin=2)
+        ts = table[:, 0].astype(np.int64)
+        ts = np.where(ts >= 10**14, ts//10**6, ts//1000)
+        order = np.argsort(ts, kind='stable')
+        return ts[order], table[order, 1:]
+
+    def load(self, symbol):
+        with self.lock:
+            klines = self.klines.get(symbol)
+            if klines is None:
+                path = os.path.join(self.directory, f"{symbol}.csv")
+                if not os.path.exists(path):
+                    raise BinanceAPIException(None, 400, ReplayFetcher.INVALID_SYMBOL)
+                klines = self.klines[symbol] = ReplayFetcher.read(path)
+                self.log.info(f"Loaded {len(klines[0])} recorded klines of {symbol}")
+            return klines
+
+    def submit(self, symbol, start, end, limit, interval='1m'):
+        future = Future()
+        try:
+            future.set_result(self.fetch(symbol, start, end, limit, interval))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def close(self):
+        pass
+
+    def fetch(self, symbol, start, end, limit, interval):
+        with self.lock:
+            self.requests += 1
+        metrics.BINANCE_SYMBOL_REQUESTS.inc(symbol=symbol)
+        metrics.BINANCE_REQUESTS.inc(status='ok')
+        ts, values = self.load(symbol)
+        step = int(interval[:-1])*ReplayFetcher.UNITS[interval[-1]]
+        first = int(start.timestamp())
+        first -= first % step
+        now = int(clock.time())
+        last = min(int(end.timestamp()), now)
+        last -= last % step
+        lo = np.searchsorted(ts, first)
+        hi = np.searchsorted(ts, min(last + step - 60, now), side='right')
+        ts, values = ts[lo:hi], values[lo:hi]
+        if not len(ts):
+            return []
+        buckets = ts - ts % step
+        bounds = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        if len(bounds) > limit:
+            ts, values, bounds = ts[:bounds[limit]], values[:bounds[limit]], bounds[:limit]
+        ends = np.r_[bounds[1:], len(ts)]
+        data = np.column_stack((
+            values[bounds, 0],
+            np.maximum.reduceat(values[:, 1], bounds),
+            np.minimum.reduceat(values[:, 2], bounds),
+            values[ends - 1, 3],
+            np.add.reduceat(values[:, 4], bounds),
+        ))
+        return [
+            [bucket*1000] + row + [(bucket + step)*1000 - 1]
+            for bucket, row in zip(buckets[bounds].tolist(), data.tolist())
+        ]
@@ -0,0 +1,73 @@
+import sys
+import sqlite3
+import threading
+from contextlib import closing
+
+def enable_incremental_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return True
+    if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0]:
+        return False
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    return True
+
+def convert_incremental_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+def convert_file(filename):
+    with closing(sqlite3.connect(filename)) as conn:
+        return convert_incremental_vacuum(conn)
+
+def enable_incremental_vacuum_file(filename):
+    with closing(sqlite3.connect(filename)) as conn:
+        return enable_incremental_vacuum(conn)
+
+def incremental_vacuum(conn, pages):
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if before:
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+class LazyDict:
+    def __init__(self, factory):
+        self.factory = factory
+        self.db = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            if self.db is None:
+                self.db = self.factory()
+            return self.db
+
+    def get(self, key, default=None):
+        return self.open().get(key, default)
+
+    def keys(self):
+        return self.open().keys()
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def __contains__(self, key):
+        return key in self.open()
+
+    def __setitem__(self, key, value):
+        self.open()[key] = value
+
+    def __delitem__(self, key):
+        del self.open()[key]
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        converted = convert_file(filename)
+        print(f"{filename}: {'converted to' if converted else 'already uses'} incremental auto-vacuum")
@@ -0,0 +1,66 @@
+import threading
+import queue
+from datetime import datetime, timedelta
+from secrets import BINANCE_API_KEY, BINANCE_SECRET_KEY
+from binance import ThreadedWebsocketManager, Client
+import logger_config
+
+class KlineStream:
+    def __init__(self, repository):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = repository
+        self.twm = ThreadedWebsocketManager(BINANCE_API_KEY, BINANCE_SECRET_KEY)
+        self.sockets = {}
+        self.lock = threading.Lock()
+        self.gaps = queue.Queue()
+        self.filler = threading.Thread(target=self.fill_gaps, daemon=True)
+
+    def start(self):
+        self.twm.start()
+        self.filler.start()
+
+    def stop(self):
+        self.twm.stop()
+        self.gaps.put(None)
+
+    def sync(self, pairs):
+        with self.lock:
+            for pair in set(self.sockets) - set(pairs):
+                self.log.info(f"Unsubscribing from {pair[0]}{pair[1]} klines")
+                self.twm.stop_socket(self.sockets.pop(pair))
+            for pair in set(pairs) - set(self.sockets):
+                fsym, tsym = pair
+                self.log.info(f"Subscribing to {fsym}{tsym} klines")
+                self.sockets[pair] = self.twm.start_kline_socket(
+                    callback=lambda msg, fsym=fsym, tsym=tsym: self.handle(fsym, tsym, msg),
+                    symbol=f"{fsym}{tsym}",
+                    interval=Client.KLINE_INTERVAL_1MINUTE
+                )
+
+    def handle(self, fsym, tsym, msg):
+        if msg.get('e') != 'kline':
+            self.log.warning(f"Unexpected message on {fsym}{tsym} kline stream: {msg}")
+            return
+        kline = msg['k']
+        point = [kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v']]
+        self.repository.set_live(fsym, tsym, point)
+        if not kline['x']:
+            return
+        last = self.repository.last_available(fsym, tsym)
+        time = datetime.fromtimestamp(kline['t']//1000)
+        if last is not None and time - last > timedelta(minutes=1):
+            self.gaps.put((fsym, tsym, last + timedelta(minutes=1), time - timedelta(minutes=1)))
+        ts = kline['t']//1000
+        self.repository.add_data(fsym, tsym, [point], (ts, ts))
+
+    def fill_gaps(self):
+        while True:
+            gap = self.gaps.get()
+            if gap is None:
+                return
+            fsym, tsym, start, end = gap
+            self.log.info(f"Filling {fsym}{tsym} gap from {start} to {end}")
+            try:
+                self.repository.get_range(fsym, tsym, start, end)
+            except Exception as err:
+                self.log.exception(f"Exception filling gap for {fsym}{tsym}: {err}")
@@ -0,0 +1,178 @@
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+import logger_config
+import clock
+import config
+from repository.market import MarketRepository
+from repository.candles import CandleStore
+from repository.sqlite import incremental_vacuum
+
+class RetentionManager:
+    DAY = 24*60*60
+
+    def __init__(self, repository, alert_handler, interval=config.RETENTION_INTERVAL_SECONDS):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = repository
+        self.alert_handler = alert_handler
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='retention', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            self.repository.migrate(self.stopping)
+        except Exception as err:
+            self.log.exception(f"Couldn't migrate the legacy prices db: {err}")
+        while not self.stopping.wait(self.interval):
+            if not self.alert_handler.warmed.is_set():
+                self.log.info("Skipping retention cycle until alerts are warmed up")
+                continue
+            try:
+                self.cycle()
+            except Exception as err:
+                self.log.exception(f"Retention cycle failed: {err}")
+
+    def lookback(self):
+        deps = list(self.alert_handler.scheduler.deps.values())
+        return timedelta(minutes=max((dep.lookback for dep in deps), default=0))
+
+    def cycle(self):
+        started = time.time()
+        lookback = self.lookback()
+        states = self.evict_states(clock.now() - lookback)
+        pairs = self.prune_pairs()
+        cutoff = clock.now() - max(lookback, timedelta(days=config.CANDLE_RETENTION_DAYS))
+        candles = self.downsample(cutoff) + self.downsample_archive(cutoff)
+        archived = self.seal(clock.now() - timedelta(days=config.ARCHIVE_AFTER_DAYS))
+        pages = self.vacuum()
+        self.log.info(
+            f"Retention evicted {states} indicator states, pruned {pairs} pairs, downsampled {candles} candles, "
+            f"archived {archived} candles and released {pages} pages in {time.time()-started:.1f} seconds"
+        )
+
+    def evict_states(self, cutoff):
+        evaluator = self.alert_handler.evaluator
+        try:
+            referenced = set(evaluator.nodes.keys())
+        except RuntimeError:
+            return 0
+        evicted = 0
+        for key in evaluator.states.keys():
+            if self.stopping.is_set():
+                break
+            if key in referenced:
+                state = evaluator.states.peek(key)
+                if state is None or state.last is None or state.last >= cutoff:
+                    continue
+            evaluator.states.remove(key)
+            evicted += 1
+        evaluator.states.flush()
+        return evicted
+
+    def prune_pairs(self):
+        active = {MarketRepository.pair_key(fsym, tsym) for fsym, tsym in self.alert_handler.scheduler.pairs()}
+        db = self.repository.db
+        pruned = 0
+        for pair in db.pairs():
+            if pair in active or self.stopping.is_set():
+                continue
+            oldest = db.oldest(pair)
+            last = db.last_available(pair)
+            if oldest is not None:
+                for start in range(oldest, last+1, RetentionManager.DAY):
+                    db.delete(pair, start, start + RetentionManager.DAY)
+            db.drop_pair(pair)
+            self.repository.archive.drop_pair(pair)
+            self.repository.coverage.discard(pair)
+            pruned += 1
+        return pruned
+
+    def downsample(self, cutoff):
+        db = self.repository.db
+        interval = config.COARSE_CANDLE_SECONDS
+        end = int(cutoff.timestamp())
+        end -= end % interval
+        downsampled = 0
+        for pair in db.pairs():
+            oldest = db.oldest(pair)
+            if oldest is None:
+                continue
+            for start in range(oldest - oldest % interval, end, RetentionManager.DAY):
+                if self.stopping.is_set():
+                    return downsampled
+                chunk_end = min(start + RetentionManager.DAY, end)
+                rows = db.downsample(pair, start, chunk_end, interval)
+                if rows:
+                    self.repository.coverage.remove(pair, start, chunk_end - 60)
+                downsampled += rows
+        return downsampled
+
+    def downsample_archive(self, cutoff):
+        archive = self.repository.archive
+        interval = config.COARSE_CANDLE_SECONDS
+        end = int(cutoff.timestamp())
+        downsampled = 0
+        for pair in self.repository.db.pairs():
+            for day in list(archive.days(pair)[0]):
+                if self.stopping.is_set():
+                    return downsampled
+                if day + RetentionManager.DAY > end:
+                    break
+                rows = archive.get_range(pair, day, day + RetentionManager.DAY - 60)
+                self.repository.db.add_coarse(pair, interval, CandleStore.aggregate(rows, interval))
+                archive.drop(pair, day)
+                self.repository.coverage.remove(pair, day, day + RetentionManager.DAY - 60)
+                downsampled += len(rows)
+        return downsampled
+
+    def seal(self, cutoff):
+        db = self.repository.db
+        archive = self.repository.archive
+        end = int(cutoff.timestamp())
+        end -= end % RetentionManager.DAY
+        sealed = 0
+        for pair in db.pairs():
+            oldest = db.oldest(pair)
+            if oldest is None:
+                continue
+            for day in range(oldest - oldest % RetentionManager.DAY, end, RetentionManager.DAY):
+                if self.stopping.is_set():
+                    return sealed
+                rows = db.get_range(pair, day, day + RetentionManager.DAY - 60)
+                if len(rows):
+                    sealed += archive.seal(pair, day, rows)
+                    db.delete(pair, day, day + RetentionManager.DAY)
+        return sealed
+
+    def vacuum(self):
+        released = 0
+        stores = [
+            self.repository.db.vacuum,
+            lambda pages: RetentionManager.vacuum_file(config.HANDLER_CACHE_DB_FILENAME, pages),
+        ]
+        for vacuum in stores:
+            while not self.stopping.is_set():
+                pages = vacuum(config.VACUUM_PAGES_PER_STEP)
+                released += pages
+                if not pages:
+                    break
+                time.sleep(0.05)
+        return released
+
+    @staticmethod
+    def vacuum_file(filename, pages):
+        try:
+            with closing(sqlite3.connect(filename, timeout=1)) as conn:
+                return incremental_vacuum(conn, pages)
+        except sqlite3.OperationalError:
+            return 0
@@ -0,0 +1,104 @@
+import heapq
+import threading
+import logger_config
+from thresholds import ThresholdIndex
+
+class AlertScheduler:
+    def __init__(self, repository):
+        self.log = logger_config.get_logger(__name__)
+        self.repository = repository
+        self.deps = {}
+        self.index = {}
+        self.thresholds = ThresholdIndex()
+        self.due = set()
+        self.cooldowns = []
+        self.until = {}
+        self.pending = set()
+        self.minute = None
+        self.lock = threading.Lock()
+
+    def add(self, key, deps, cooldown=None, threshold=None):
+        with self.lock:
+            self.deps[key] = deps
+            if threshold is None:
+                for pair in deps.pairs:
+                    self.index.setdefault(pair, set()).add(key)
+            else:
+                self.thresholds.add(key, *threshold)
+                if cooldown is None:
+                    self.thresholds.arm(key)
+            self.due.add(key)
+            self.until.pop(key, None)
+            if cooldown is not None:
+                self.until[key] = cooldown
+                heapq.heappush(self.cooldowns, (cooldown, key))
+
+    def remove(self, key):
+        with self.lock:
+            deps = self.deps.pop(key, None)
+            if deps is None:
+                return
+            self.thresholds.remove(key)
+            for pair in deps.pairs:
+                keys = self.index.get(pair)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.index[pair]
+                if pair not in self.index and not self.thresholds.watching(pair):
+                    self.pending.discard(pair)
+            self.due.discard(key)
+            self.until.pop(key, None)
+
+    def cooldown(self, key, until):
+        with self.lock:
+            if key not in self.deps:
+                return
+            self.until[key] = until
+            heapq.heappush(self.cooldowns, (until, key))
+            self.thresholds.disarm(key)
+
+    def pairs(self):
+        with self.lock:
+            return set(self.index) | self.thresholds.pairs()
+
+    def collect(self, time, now):
+        minute = time.replace(second=0, microsecond=0)
+        with self.lock:
+            if minute != self.minute:
+                self.minute = minute
+                self.pending = set(self.index) | self.thresholds.pairs()
+            pending = list(self.pending)
+        ready, errors = self.repository.poll(pending, minute)
+        for (fsym, tsym), err in errors.items():
+            self.log.error(f"Couldn't get the {minute} candle of {fsym}/{tsym}: {err}")
+        with self.lock:
+            self.pending -= set(errors)
+            ready = [pair for pair in ready if pair in self.pending]
+            for pair in ready:
+                self.pending.discard(pair)
+                self.due |= self.index.get(pair, set())
+        crossed = self.crossed(ready, minute)
+        with self.lock:
+            self.due.update(crossed)
+            while self.cooldowns and self.cooldowns[0][0] <= now:
+                until, key = heapq.heappop(self.cooldowns)
+                if self.until.get(key) == until:
+                    del self.until[key]
+                    self.thresholds.arm(key)
+                    self.due.add(key)
+            due, self.due = self.due, set()
+        return due
+
+    def crossed(self, pairs, minute):
+        crossed = []
+        for fsym, tsym in pairs:
+            if not self.thresholds.watching((fsym, tsym)):
+                continue
+            try:
+                values = self.repository.get_values(fsym, tsym, minute)
+            except Exception as err:
+                self.log.error(f"Couldn't get the {minute} price of {fsym}/{tsym}: {err}")
+                continue
+            crossed += self.thresholds.crossed((fsym, tsym), values)
+        return crossed
@@ -1,29 +1,101 @@
+import os
 import time
+import threading
 import logger_config
+import clock
 import config
 from repository.market import MarketRepository
+from repository.stream import KlineStream
+from repository.alerts import AlertStore
+from repository.notifications import NotificationStore
 from command_handler import CommandHandler
+from command_pool import CommandPool
 from alert_handler import AlertHandler
-from sqlitedict import SqliteDict
+from notifier import Notifier
+from parallel import EvaluationPool
+import metrics
+from retention import RetentionManager
 from calculator import Calculator
+from vector_calculator import VectorCalculator
 from telegram.ext import Updater
 
 class TgBotService:
 
-    def __init__(self):
+    def __init__(self, updater=None, fetcher=None):
         self.log = logger_config.get_logger(__name__)
-        self.db = SqliteDict(config.DB_FILENAME)
-        calculator = Calculator(MarketRepository())
-        self.updater = Updater(token=config.TG_TOKEN, use_context=True)
-        self.alert_handler = AlertHandler(self.db, calculator, self.updater.bot)
-        self.command_handler = CommandHandler(self.alert_handler, self.updater.dispatcher)
+        self.store = AlertStore(config.ALERTS_DB_FILENAME)
+        if os.path.exists(config.DB_FILENAME):
+            self.store.migrate_sqlitedict(config.DB_FILENAME)
+        self.repository = MarketRepository(fetcher=fetcher)
+        if config.CALCULATOR_BACKEND == 'vector':
+            calculator = VectorCalculator(self.repository)
+        else:
+            calculator = Calculator(self.repository)
+        self.stream = None
+        if config.STREAM_KLINES:
+            self.stream = KlineStream(self.repository)
+            self.stream.start()
+        self.updater = updater if updater is not None else Updater(token=config.TG_TOKEN, use_context=True)
+        self.notifications = NotificationStore(config.ALERTS_DB_FILENAME)
+        self.notifier = Notifier(self.updater.bot, self.notifications)
+        self.pool = None
+        if config.EVAL_WORKERS > 1:
+            self.pool = EvaluationPool(self.repository)
+        self.alert_handler = AlertHandler(self.store, calculator, self.notifier, self.stream, self.pool)
+        self.commands = CommandPool()
+        self.command_handler = CommandHandler(self.alert_handler, self.updater.dispatcher, self.commands)
+        self.retention = RetentionManager(self.repository, self.alert_handler)
+        self.stopping = threading.Event()
+        self.metrics_server = None
+        if config.METRICS_PORT is not None:
+            self.metrics_server = metrics.MetricsServer(config.METRICS_PORT)
+
+    def collect_metrics(self):
+        caches = {'indicators': self.alert_handler.evaluator.states, 'prices': self.repository.cache}
+        for name, cache in caches.items():
+            stats = cache.stats()
+            metrics.CACHE_HITS.set(stats['hits'], cache=name)
+            metrics.CACHE_MISSES.set(stats['misses'], cache=name)
+            metrics.CACHE_EVICTIONS.set(stats['evictions'], cache=name)
+            metrics.CACHE_ENTRIES.set(stats['entries'], cache=name)
+            metrics.CACHE_BYTES.set(stats['bytes'], cache=name)
+        dbs = {
+            'alerts': config.ALERTS_DB_FILENAME,
+            'candles': config.CANDLES_DB_FILENAME,
+            'indicators': config.HANDLER_CACHE_DB_FILENAME,
+        }
+        for name, filename in dbs.items():
+            size = sum(os.path.getsize(f) for f in (filename, f"{filename}-wal") if os.path.exists(f))
+            metrics.DB_BYTES.set(size, db=name)
+        metrics.QUEUE_DEPTH.set(self.notifier.depth(), queue='notifications')
+        metrics.QUEUE_DEPTH.set(len(self.alert_handler.scheduler.pending), queue='pending_pairs')
+        metrics.QUEUE_DEPTH.set(len(self.repository.fetcher.inflight), queue='binance_inflight')
+        metrics.QUEUE_DEPTH.set(self.commands.depth(), queue='commands')
+        if self.stream is not None:
+            metrics.QUEUE_DEPTH.set(self.stream.gaps.qsize(), queue='stream_gaps')
 
 
     def run(self):
         self.last_time = 0
+        self.notifier.start()
+        self.retention.start()
+        metrics.REGISTRY.collectors.append(self.collect_metrics)
+        if self.metrics_server is not None:
+            self.metrics_server.start()
         self.updater.start_polling()
         self.alert_loop()
         self.updater.stop()
+        self.commands.stop()
+        self.notifier.stop()
+        self.retention.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        metrics.REGISTRY.collectors.remove(self.collect_metrics)
+        if self.stream is not None:
+            self.stream.stop()
+        self.repository.close()
+        self.store.close()
+        self.notifications.close()
 
     def process_alerts(self):
         start = time.time()
@@ -31,24 +103,32 @@ class TgBotService:
             self.log.info("Start checking alerts")
         self.alert_handler.process()
         end = time.time()
+        metrics.CYCLE_SECONDS.observe(end-start)
         if start-self.last_time>=10*60:
             self.last_time = end
             self.log.info(f"Checking alerts took {(end-start)} seconds")
+            self.log.info(f"Indicator cache stats: {self.alert_handler.evaluator.states.stats()}")
+            self.log.info(f"Price cache stats: {self.repository.cache.stats()}")
+            self.log.info(f"Notification queue depth: {self.notifier.depth()}")
+
+    def stop(self):
+        self.stopping.set()
 
     def alert_loop(self):
-        loop = True
-        while loop:
+        self.alert_handler.warm_up()
+        while not self.stopping.is_set():
             try:
                 self.process_alerts()
-                time.sleep(1)
+                clock.sleep(1)
             except KeyboardInterrupt:
                 self.log.info("interrupt received, stopping...")
-                loop = False
+                self.stop()
             except Exception as err:
                 self.log.exception(f"Exception at processing alerts {err}")
-                loop = False
-
-            self.db.commit()
+                self.stop()
+        self.alert_handler.evaluator.checkpoint()
+        if self.pool is not None:
+            self.pool.close()
 
 if __name__ == "__main__":
     service = TgBotService()
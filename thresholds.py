@@ -0,0 +1,108 @@
+import threading
+from operator import itemgetter
+from lark import Tree
+from sortedcontainers import SortedKeyList
+
+class ThresholdIndex:
+    FLIPPED = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+    def __init__(self):
+        self.thresholds = {}
+        self.watched = {}
+        self.buckets = {}
+        self.armed = set()
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def constant(tree):
+        if not isinstance(tree, Tree) or tree.data not in ('number', 'percentage'):
+            return None
+        n = float(tree.children[0])
+        return n/100 if tree.data == 'percentage' else n
+
+    @staticmethod
+    def match(parsed):
+        cond = parsed.children[-1]
+        if not isinstance(cond, Tree) or cond.data != 'condition':
+            return None
+        p, op, q = cond.children
+        op = str(op)
+        if op not in ThresholdIndex.FLIPPED:
+            return None
+        if isinstance(q, Tree) and q.data == 'price':
+            p, q, op = q, p, ThresholdIndex.FLIPPED[op]
+        threshold = ThresholdIndex.constant(q)
+        if not isinstance(p, Tree) or p.data != 'price' or threshold is None:
+            return None
+        candle, pair = p.children
+        candle = 'close' if candle == 'price' else str(candle)
+        return ((str(pair.children[0]).upper(), str(pair.children[1]).upper()), candle, op, threshold)
+
+    def __contains__(self, key):
+        return key in self.thresholds
+
+    def pairs(self):
+        with self.lock:
+            return set(self.watched)
+
+    def watching(self, pair):
+        return pair in self.watched
+
+    def add(self, key, pair, candle, op, threshold):
+        with self.lock:
+            self.remove(key)
+            self.thresholds[key] = (pair, candle, op, threshold)
+            self.watched[pair] = self.watched.get(pair, 0) + 1
+
+    def remove(self, key):
+        with self.lock:
+            self.disarm(key)
+            entry = self.thresholds.pop(key, None)
+            if entry is None:
+                return
+            pair = entry[0]
+            self.watched[pair] -= 1
+            if not self.watched[pair]:
+                del self.watched[pair]
+
+    def arm(self, key):
+        with self.lock:
+            entry = self.thresholds.get(key)
+            if entry is None or key in self.armed:
+                return
+            pair, candle, op, threshold = entry
+            bucket = self.buckets.setdefault(pair, {}).get((candle, op))
+            if bucket is None:
+                bucket = self.buckets[pair][(candle, op)] = SortedKeyList(key=itemgetter(0))
+            bucket.add((threshold, key))
+            self.armed.add(key)
+
+    def disarm(self, key):
+        with self.lock:
+            if key not in self.armed:
+                return
+            pair, candle, op, threshold = self.thresholds[key]
+            buckets = self.buckets[pair]
+            bucket = buckets[(candle, op)]
+            bucket.remove((threshold, key))
+            self.armed.discard(key)
+            if not bucket:
+                del buckets[(candle, op)]
+                if not buckets:
+                    del self.buckets[pair]
+
+    def crossed(self, pair, candle_values):
+        crossed = []
+        with self.lock:
+            for (candle, op), bucket in self.buckets.get(pair, {}).items():
+                value = candle_values[candle]
+                if op == '>':
+                    entries = bucket.islice(0, bucket.bisect_key_left(value))
+                elif op == '>=':
+                    entries = bucket.islice(0, bucket.bisect_key_right(value))
+                elif op == '<':
+                    entries = bucket.islice(bucket.bisect_key_right(value))
+                else:
+                    entries = bucket.islice(bucket.bisect_key_left(value))
+                crossed += [key for _, key in entries]
+        return crossed
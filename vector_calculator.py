@@ -0,0 +1,195 @@
+from datetime import datetime
+import numpy as np
+from calculator import Calculator
+
+class VectorCalculator(Calculator):
+    MAX_GATHER = 1 << 20
+
+    @staticmethod
+    def timestamps(time):
+        return np.array([int(time.replace(second=0, microsecond=0).timestamp())], dtype=np.int64)
+
+    @staticmethod
+    def previous(times, step):
+        return times - times % step - 60
+
+    @staticmethod
+    def adj_array(upwards, v):
+        if upwards is None:
+            return v
+        if upwards:
+            return np.where(v<0, 0., v)
+        return np.where(v>0, 0., v)
+
+    def price(self, fsym, tsym, candle, t):
+        if isinstance(t, datetime):
+            return super().price(fsym, tsym, candle, t)
+        rows = self.repository.get_range(fsym, tsym, datetime.fromtimestamp(int(t.min())), datetime.fromtimestamp(int(t.max())))
+        if len(rows):
+            pos = np.searchsorted(rows['ts'], t).clip(max=len(rows)-1)
+            values = rows[candle][pos]
+            found = rows['ts'][pos] == t
+        else:
+            values = np.empty(len(t))
+            found = np.zeros(len(t), dtype=bool)
+        for i in np.flatnonzero(~found):
+            values[i] = super().price(fsym, tsym, candle, datetime.fromtimestamp(int(t[i])))
+        return values
+
+    def candle(self, fsym, tsym, candle, interval, t):
+        if isinstance(t, datetime):
+            return super().candle(fsym, tsym, candle, interval, t)
+        step = interval*60
+        buckets = t - t % step
+        values = np.empty(len(t))
+        found = np.zeros(len(t), dtype=bool)
+        rows = self.repository.get_candles(fsym, tsym, interval, datetime.fromtimestamp(int(buckets.min())), datetime.fromtimestamp(int(t.max())))
+        if len(rows):
+            pos = np.searchsorted(rows['ts'], buckets).clip(max=len(rows)-1)
+            found = (t - buckets == step - 60) & (rows['ts'][pos] == buckets)
+            values[found] = rows[candle][pos[found]]
+        if not found.all():
+            values[~found] = self.partial(fsym, tsym, candle, interval, t[~found])
+        return values
+
+    def partial(self, fsym, tsym, candle, interval, t):
+        if candle == 'close':
+            return self.price(fsym, tsym, candle, t)
+        step = interval*60
+        rows = self.repository.get_range(fsym, tsym, datetime.fromtimestamp(int((t - t % step).min())), datetime.fromtimestamp(int(t.max())))
+        values = np.empty(len(t))
+        found = np.zeros(len(t), dtype=bool)
+        if len(rows):
+            buckets = rows['ts'] - rows['ts'] % step
+            bounds = np.r_[np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]]), len(rows)]
+            segments = np.repeat(np.arange(len(bounds)-1), np.diff(bounds))
+            column = rows[candle]
+            if candle == 'open':
+                running = column[bounds[:-1]][segments]
+            elif candle == 'volume':
+                total = np.cumsum(column)
+                running = total - (total - column)[bounds[:-1]][segments]
+            else:
+                accumulate = np.maximum.accumulate if candle == 'high' else np.minimum.accumulate
+                running = np.concatenate([accumulate(column[s:e]) for s, e in zip(bounds[:-1], bounds[1:])])
+            pos = np.searchsorted(rows['ts'], t).clip(max=len(rows)-1)
+            found = rows['ts'][pos] == t
+            values[found] = running[pos[found]]
+        for i in np.flatnonzero(~found):
+            values[i] = super().candle(fsym, tsym, candle, interval, datetime.fromtimestamp(int(t[i])))
+        return values
+
+    def change(self, fun, interval, t):
+        if isinstance(t, datetime):
+            return super().change(fun, interval, t)
+        previous = VectorCalculator.previous(t, interval*60)
+        support = np.unique(np.concatenate([previous, t]))
+        values = np.broadcast_to(fun(support), support.shape)
+        old = values[np.searchsorted(support, previous)]
+        return (values[np.searchsorted(support, t)]-old)/old
+
+    def if_exp(self, cond, p, q, t):
+        if isinstance(t, datetime):
+            return super().if_exp(cond, p, q, t)
+        return np.where(cond(t), p(t), q(t))
+
+    def rsi(self, up, down, t):
+        if isinstance(t, datetime):
+            return super().rsi(up, down, t)
+        rs_up = up(t)
+        rs_down = np.abs(down(t))
+        flat = rs_down < 1e-9
+        return np.where(flat, 100., 100. - 100. / (1. + rs_up/np.where(flat, 1., rs_down)))
+
+    def lagged(self, fun, times, lags, step, extra=()):
+        first = times.min() - lags.max()
+        if len(times)*len(lags) <= VectorCalculator.MAX_GATHER:
+            support = (times[:, None] - lags[None, :]).ravel()
+        else:
+            support = np.arange(first, times.max() + 1, step)
+            if not extra:
+                values = np.broadcast_to(fun(support), support.shape)
+                return lambda at: values[(at - first)//step]
+        support = np.unique(np.concatenate([support, *extra]))
+        values = np.broadcast_to(fun(support), support.shape)
+        return lambda at: values[np.searchsorted(support, at)]
+
+    @staticmethod
+    def sma_sum(values, times, window, step, upwards):
+        total = 0
+        for x in range(window):
+            total = total + VectorCalculator.adj_array(upwards, values(times - (window-1-x)*step))
+        return total
+
+    def sma(self, fun, window, interval, time, upwards=None):
+        if isinstance(time, datetime):
+            return float(self.sma(fun, window, interval, VectorCalculator.timestamps(time), upwards)[0])
+        step = interval*60
+        total = 0
+        if window > 1:
+            previous = VectorCalculator.previous(time, step)
+            values = self.lagged(fun, previous, np.arange(window-1)*step, step, (time,))
+            total = VectorCalculator.sma_sum(values, previous, window-1, step, upwards)
+            return (total + VectorCalculator.adj_array(upwards, values(time))) / window
+        return VectorCalculator.adj_array(upwards, fun(time)) / window
+
+    def smma(self, fun, window, interval, time, alpha, upwards=None):
+        if isinstance(time, datetime):
+            self.log.info(f"Calculating vectorized smma from scratch for window={window}, interval={interval}, time={time}, upwards={upwards}")
+            return float(self.smma(fun, window, interval, VectorCalculator.timestamps(time), alpha, upwards)[0])
+        step = interval*60
+        closed = time % step == step - 60
+        anchors = np.where(closed, time, VectorCalculator.previous(time, step))
+        ends = np.unique(anchors)
+        gaps = np.diff(ends)
+        bridged = np.flatnonzero((gaps > step) & (gaps <= window*step))
+        if len(bridged):
+            ends = np.unique(np.concatenate([ends] + [np.arange(ends[i] + step, ends[i+1], step) for i in bridged.tolist()]))
+        prev = np.searchsorted(ends, ends - step)
+        linked = ends[prev.clip(max=len(ends)-1)] == ends - step
+        heads = ends[~linked]
+        values = self.lagged(fun, heads, np.arange(3*window)*step, step, (ends, time))
+        smma = VectorCalculator.sma_sum(values, heads - 2*window*step, window, step, upwards) / window
+        for lag in range(2*window-1, -1, -1):
+            smma = VectorCalculator.adj_array(upwards, values(heads - lag*step)) * alpha + smma * (1-alpha)
+        chain = np.empty(len(ends))
+        chain[~linked] = smma
+        if linked.any():
+            today = VectorCalculator.adj_array(upwards, values(ends)).tolist()
+            links = chain.tolist()
+            prev = prev.tolist()
+            for i in np.flatnonzero(linked).tolist():
+                links[i] = today[i] * alpha + links[prev[i]] * (1-alpha)
+            chain = np.array(links)
+        chain = chain[np.searchsorted(ends, anchors)]
+        today = VectorCalculator.adj_array(upwards, values(time))
+        return np.where(closed, chain, today * alpha + chain * (1-alpha))
+
+    @staticmethod
+    def sliding(values, window, ufunc, fill):
+        n = len(values)
+        blocks = np.concatenate([values, np.full((-n) % window, fill)]).reshape(-1, window)
+        prefix = ufunc.accumulate(blocks, axis=1).ravel()
+        suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+        return ufunc(suffix[:n-window+1], prefix[window-1:n])
+
+    def extremum(self, fun, window, interval, time, sign):
+        if isinstance(time, datetime):
+            return super().extremum(fun, window, interval, time, sign)
+        ufunc, fill = (np.maximum, -np.inf) if sign > 0 else (np.minimum, np.inf)
+        current = np.broadcast_to(fun(time), time.shape)
+        if window == 1:
+            return np.array(current, dtype=np.float64)
+        step = interval*60
+        previous = VectorCalculator.previous(time, step)
+        first = previous.min() - (window-2)*step
+        if (previous.max() - first)//step < VectorCalculator.MAX_GATHER:
+            grid = np.arange(first, previous.max() + 1, step)
+            best = VectorCalculator.sliding(np.broadcast_to(fun(grid), grid.shape).astype(np.float64), window-1, ufunc, fill)
+            best = best[(previous - previous.min())//step]
+        else:
+            values = self.lagged(fun, previous, np.arange(window-1)*step, step)
+            best = values(previous)
+            for lag in range(1, window-1):
+                best = ufunc(best, values(previous - lag*step))
+        return ufunc(current, best)